@@ -0,0 +1,75 @@
+class CallSessionRegistry:
+    """
+    In-process registry of call sockets and active calls, keyed by the
+    authenticated user id. Every lookup is a dict access, so signaling can
+    go straight to the peer's channel instead of through a group.
+
+    Only sockets on this worker are known; callers fall back to the
+    name-based groups for peers connected elsewhere.
+    """
+
+    def __init__(self):
+        self._channels = {}  # user_id -> channel_name
+        self._user_ids = {}  # username -> user_id
+        self._names = {}  # user_id -> username
+        self._peers = {}  # user_id -> user_id, stored for both sides of a call
+
+    def register(self, user_id, name, channel_name):
+        old_name = self._names.get(user_id)
+        if old_name is not None and old_name != name:
+            self._user_ids.pop(old_name, None)
+        self._channels[user_id] = channel_name
+        self._user_ids[name] = user_id
+        self._names[user_id] = name
+
+    def unregister(self, user_id, channel_name):
+        """Forget the socket and end its call; returns the peer that has to be told, if any."""
+        if self._channels.get(user_id) != channel_name:
+            # Another tab took over the registration in the meantime.
+            return None
+        del self._channels[user_id]
+        self._user_ids.pop(self._names.pop(user_id, None), None)
+        return self.end_call(user_id)
+
+    def channel_for(self, user_id):
+        return self._channels.get(user_id)
+
+    def user_id_for(self, name):
+        return self._user_ids.get(name)
+
+    def name_for(self, user_id):
+        return self._names.get(user_id)
+
+    def is_busy(self, user_id, caller_id=None):
+        """True if the user is in a call with someone other than ``caller_id``."""
+        return self._peers.get(user_id) not in (None, caller_id)
+
+    def start_call(self, caller_id, callee_id):
+        """
+        Pair the two users, ending whatever call either side was in before.
+        Returns ``(peer_id, left_by)`` for every peer dropped that way, so
+        they can be told the call ended.
+        """
+        evicted = []
+        for user_id in (caller_id, callee_id):
+            peer_id = self.end_call(user_id)
+            if peer_id is not None and peer_id not in (caller_id, callee_id):
+                evicted.append((peer_id, user_id))
+        self._peers[caller_id] = callee_id
+        self._peers[callee_id] = caller_id
+        return evicted
+
+    def peer_of(self, user_id):
+        return self._peers.get(user_id)
+
+    def end_call(self, user_id):
+        peer_id = self._peers.pop(user_id, None)
+        if peer_id is not None and self._peers.get(peer_id) == user_id:
+            del self._peers[peer_id]
+        return peer_id
+
+    def __len__(self):
+        return len(self._channels)
+
+
+call_sessions = CallSessionRegistry()
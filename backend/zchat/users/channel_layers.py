@@ -0,0 +1,200 @@
+import asyncio
+import bisect
+import contextvars
+import fnmatch
+import hashlib
+import re
+import time
+import uuid
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+from channels_redis.core import RedisChannelLayer
+
+# Capacity of the group currently being sent to, see ShardedRedisChannelLayer.group_send.
+_group_capacity = contextvars.ContextVar("group_capacity", default=None)
+
+
+class HashRing:
+    """
+    Consistent hash ring over shard indexes. Adding a shard only moves the
+    keys that land on its points, instead of remapping almost every group
+    like ``crc32(name) % shards`` does. New shards should be appended to the
+    host list so existing indexes keep their place on the ring.
+    """
+
+    def __init__(self, nodes, replicas=100):
+        self._ring = sorted(
+            (self._hash(f"{node}:{replica}"), node)
+            for node in nodes
+            for replica in range(replicas)
+        )
+        self._points = [point for point, _ in self._ring]
+
+    @staticmethod
+    def _hash(value):
+        return int.from_bytes(hashlib.md5(value.encode("utf8")).digest()[:8], "big")
+
+    def get_node(self, key):
+        index = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+        return self._ring[index][1]
+
+
+class GroupPolicyMixin:
+    """
+    Looks up the expiry and capacity that apply to a group from glob patterns
+    such as ``{"chat_*": {"expiry": 86400, "capacity": 100}}``. The first
+    matching pattern wins; unmatched groups use the layer defaults.
+    """
+
+    def compile_group_policies(self, group_policies):
+        return [
+            (
+                re.compile(fnmatch.translate(pattern)),
+                policy.get("expiry", self.group_expiry),
+                policy.get("capacity", self.capacity),
+            )
+            for pattern, policy in group_policies.items()
+        ]
+
+    def get_group_policy(self, group):
+        for pattern, expiry, capacity in self.group_policies:
+            if pattern.match(group):
+                return expiry, capacity
+        return self.group_expiry, self.capacity
+
+
+class ShardedRedisChannelLayer(GroupPolicyMixin, RedisChannelLayer):
+    """
+    Redis channel layer that spreads groups and channels over several hosts
+    with a consistent hash ring and applies a per group type expiry/capacity.
+    """
+
+    def __init__(self, hosts=None, group_policies=None, ring_replicas=100, **kwargs):
+        super().__init__(hosts=hosts, **kwargs)
+        self.ring = HashRing(range(self.ring_size), replicas=ring_replicas)
+        self.group_policies = self.compile_group_policies(group_policies or {})
+        # group_send prunes members older than group_expiry, so it has to
+        # cover the longest policy; shorter ones are handled in group_add.
+        self.group_expiry = max([self.group_expiry] + [expiry for _, expiry, _ in self.group_policies])
+
+    def consistent_hash(self, value):
+        # send() hashes the full "specific.X!Y" name of a process-local
+        # channel, but receive() hashes its "specific.X!" prefix; both must
+        # land on the shard the receiving process reads from.
+        if "!" in value:
+            value = self.non_local_name(value)
+        return self.ring.get_node(value)
+
+    async def group_add(self, group, channel):
+        assert self.require_valid_group_name(group), "Group name not valid"
+        assert self.require_valid_channel_name(channel), "Channel name not valid"
+        expiry, _ = self.get_group_policy(group)
+        group_key = self._group_key(group)
+        connection = self.connection(self.consistent_hash(group))
+        # Back-date the membership so the shared group_expiry cutoff in
+        # group_send drops it after this group's own expiry.
+        await connection.zadd(group_key, {channel: time.time() - (self.group_expiry - expiry)})
+        await connection.expire(group_key, expiry)
+
+    async def group_send(self, group, message):
+        _, capacity = self.get_group_policy(group)
+        token = _group_capacity.set(capacity)
+        try:
+            await super().group_send(group, message)
+        finally:
+            _group_capacity.reset(token)
+
+    def get_capacity(self, channel):
+        capacity = _group_capacity.get()
+        if capacity is not None:
+            return capacity
+        return super().get_capacity(channel)
+
+
+class ShardedInMemoryChannelLayer(GroupPolicyMixin, BaseChannelLayer):
+    """
+    In-process stand-in for ShardedRedisChannelLayer. Each shard keeps its
+    own channels and groups, and everything is routed through the same hash
+    ring and group policies, so routing can be tested without Redis.
+    """
+
+    extensions = ["groups", "flush"]
+
+    def __init__(
+        self,
+        shards=2,
+        expiry=60,
+        group_expiry=86400,
+        capacity=100,
+        channel_capacity=None,
+        group_policies=None,
+        ring_replicas=100,
+        **kwargs,
+    ):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.group_expiry = group_expiry
+        self.shard_count = shards
+        self.ring = HashRing(range(shards), replicas=ring_replicas)
+        self.group_policies = self.compile_group_policies(group_policies or {})
+        self.flush_sync()
+
+    def flush_sync(self):
+        self.shards = [{"channels": {}, "groups": {}} for _ in range(self.shard_count)]
+
+    def shard_for(self, name):
+        # Process-local channels live on their process's shard, as with Redis.
+        if "!" in name:
+            name = self.non_local_name(name)
+        return self.shards[self.ring.get_node(name)]
+
+    async def send(self, channel, message, capacity=None):
+        assert isinstance(message, dict), "message is not a dict"
+        assert self.require_valid_channel_name(channel), "Channel name not valid"
+        queue = self.shard_for(channel)["channels"].setdefault(channel, asyncio.Queue())
+        if queue.qsize() >= (capacity or self.get_capacity(channel)):
+            raise ChannelFull(channel)
+        queue.put_nowait(dict(message))
+
+    async def receive(self, channel):
+        assert self.require_valid_channel_name(channel), "Channel name not valid"
+        queue = self.shard_for(channel)["channels"].setdefault(channel, asyncio.Queue())
+        return await queue.get()
+
+    async def new_channel(self, prefix="specific"):
+        return f"{prefix}.sharded!{uuid.uuid4().hex}"
+
+    async def flush(self):
+        self.flush_sync()
+
+    async def close(self):
+        pass
+
+    async def group_add(self, group, channel):
+        assert self.require_valid_group_name(group), "Group name not valid"
+        assert self.require_valid_channel_name(channel), "Channel name not valid"
+        self.shard_for(group)["groups"].setdefault(group, {})[channel] = time.time()
+
+    async def group_discard(self, group, channel):
+        assert self.require_valid_group_name(group), "Group name not valid"
+        assert self.require_valid_channel_name(channel), "Channel name not valid"
+        groups = self.shard_for(group)["groups"]
+        if group in groups:
+            groups[group].pop(channel, None)
+            if not groups[group]:
+                del groups[group]
+
+    async def group_send(self, group, message):
+        assert isinstance(message, dict), "Message is not a dict"
+        assert self.require_valid_group_name(group), "Group name not valid"
+        expiry, capacity = self.get_group_policy(group)
+        members = self.shard_for(group)["groups"].get(group, {})
+        cutoff = time.time() - expiry
+        for channel, added in list(members.items()):
+            if added < cutoff:
+                del members[channel]
+                continue
+            try:
+                await self.send(channel, message, capacity=capacity)
+            except ChannelFull:
+                pass
@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.checks import Error, Tags, register
+
+
+def is_shared_cache(cache_backend):
+    """Local-memory and dummy caches live in one process, so other workers never see their entries."""
+    return not isinstance(cache_backend, (LocMemCache, DummyCache))
+
+
+@register(Tags.caches)
+def check_history_cache(app_configs, **kwargs):
+    # Each worker would keep its own conversation versions and serve pages
+    # the other workers have already invalidated.
+    alias = getattr(settings, "HISTORY_CACHE_ALIAS", "default")
+    if alias not in settings.CACHES:
+        return [Error(f"HISTORY_CACHE_ALIAS {alias!r} is not in CACHES.", id="users.E001")]
+    if not is_shared_cache(caches[alias]):
+        return [
+            Error(
+                f"HISTORY_CACHE_ALIAS {alias!r} points at a per-process cache.",
+                hint="Use a cache shared by all workers, such as RedisCache.",
+                id="users.E002",
+            )
+        ]
+    return []
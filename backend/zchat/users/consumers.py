@@ -1,30 +1,75 @@
-import json
-from channels.generic.websocket import AsyncJsonWebsocketConsumer, WebsocketConsumer
-from .models import UserMessage
+import asyncio
+from functools import partial
+from channels.generic.websocket import AsyncJsonWebsocketConsumer, AsyncWebsocketConsumer
+from .call_sessions import call_sessions
+from .drain import DrainMixin, SERVICE_RESTART, drain
+from .framing import FramingMixin, decode, msgpack
+from .history_cache import history_cache
+from .models import RoomMembership, RoomMessage, UserMessage
+from .presence import presence
+from .rate_limit import RateLimiter
+from .typing_indicators import typing_throttle
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from asgiref.sync import sync_to_async, async_to_sync
+from channels.db import database_sync_to_async
+from channels.consumer import get_handler_name
 
 User = get_user_model()
 
-class ChatConsumer(AsyncJsonWebsocketConsumer):
+class ChatConsumer(DrainMixin, FramingMixin, AsyncJsonWebsocketConsumer):
     async def connect(self):
         self.room_name = self.scope["url_route"]["kwargs"]["token"]
         self.room_group_name = f"chat_{self.scope['user'].id}"
+        if not await self.start_drain_tracking():
+            return
         print(f"WebSocket connected for user: {self.scope['user']}, token: {self.room_name}")
+        self.rate_limiter = RateLimiter(self.scope["user"].id)
         await self.channel_layer.group_add(self.room_group_name, self.channel_name)
-        await self.accept()
+        await self.accept_framing()
+        self.room_ids = set()
+        if self.scope["user"].id:
+            await presence.connect(self.scope["user"].id, self.channel_name)
+            presence.start(self.channel_layer)
+            for room_id in await self.get_room_ids():
+                await self.join_room(room_id)
 
     async def disconnect(self, close_code):
         print(f"WebSocket disconnected: {close_code}")
+        self.stop_drain_tracking()
         await self.channel_layer.group_discard(self.room_group_name, self.channel_name)
+        for room_id in getattr(self, "room_ids", ()):
+            await self.channel_layer.group_discard(f"room_{room_id}", self.channel_name)
+        if self.scope["user"].id:
+            await presence.disconnect(self.scope["user"].id, self.channel_name)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        await self.receive_event(decode(text_data, bytes_data))
+
+    async def receive_event(self, text_data_json):
+        # Drop floods before any database or channel-layer work.
+        event_type = self.get_event_type(text_data_json)
+        if not await self.rate_limiter.aallow(event_type):
+            await self.send_event({"error": "Rate limit exceeded", "event": event_type})
+            return
 
-    async def receive(self, text_data):
-        text_data_json = json.loads(text_data)
         print("Received chat data", text_data_json)
 
+        if text_data_json.get("type") == "heartbeat":
+            if self.scope["user"].id:
+                await presence.heartbeat(self.scope["user"].id, self.channel_name)
+            return
+
+        if text_data_json.get("type") == "typing":
+            await self.relay_typing(text_data_json)
+            return
+
+        if "room_id" in text_data_json:
+            await self.room_receive(text_data_json)
+            return
+
         if "message" not in text_data_json:
             print("Not a chat message, ignoring")
-            await self.send(text_data=json.dumps({"error": "Invalid message format: 'message' key required"}))
+            await self.send_event({"error": "Invalid message format: 'message' key required"})
             return
 
         message = text_data_json["message"]
@@ -35,12 +80,12 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
 
         if not receiver_id and not receiver_username:
             print("No receiver specified in message")
-            await self.send(text_data=json.dumps({"error": "Receiver not specified"}))
+            await self.send_event({"error": "Receiver not specified"})
             return
 
         print(f"Received message from {sender_username}: {message}, receiver_id: {receiver_id}, receiver_username: {receiver_username}")
 
-        @sync_to_async
+        @database_sync_to_async
         def save_message():
             try:
                 sender_instance = User.objects.get(pk=sender_id)
@@ -61,10 +106,11 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
                 raise
 
         try:
-            message_id, timestamp, receiver_id = await save_message()
+            with drain.track():
+                message_id, timestamp, receiver_id = await save_message()
         except Exception as e:
             print(f"Error in save_message: {str(e)}")
-            await self.send(text_data=json.dumps({"error": f"Failed to save message: {str(e)}"}))
+            await self.send_event({"error": f"Failed to save message: {str(e)}"})
             return
 
         # Send message to sender and receiver groups
@@ -92,43 +138,310 @@ class ChatConsumer(AsyncJsonWebsocketConsumer):
         )
 
     async def chat_message(self, event):
-        await self.send(text_data=json.dumps({
+        await self.send_event({
             "message": event["message"],
             "sender_id": event["sender_id"],
             "receiver_id": event["receiver_id"],
             "timestamp": event["timestamp"],
             "message_id": event["message_id"],
-        }))
+        })
+
+    def get_event_type(self, data):
+        if "type" in data:
+            return data["type"]
+        if "room_id" in data:
+            return "room_message"
+        return "message"
+
+    @database_sync_to_async
+    def get_room_ids(self):
+        return list(
+            RoomMembership.objects.filter(user_id=self.scope["user"].id).values_list("room_id", flat=True)
+        )
+
+    async def join_room(self, room_id):
+        self.room_ids.add(room_id)
+        await self.channel_layer.group_add(f"room_{room_id}", self.channel_name)
+
+    async def room_joined(self, event):
+        # Sent when the user is added to a room while this socket is open.
+        await self.join_room(event["room_id"])
+        await self.send_event({"type": "room_joined", "room_id": event["room_id"]})
+
+    async def room_receive(self, data):
+        try:
+            room_id = int(data["room_id"])
+        except (TypeError, ValueError):
+            await self.send_event({"error": "Invalid room message: integer 'room_id' required"})
+            return
+        sender_id = self.scope["user"].id
+
+        @database_sync_to_async
+        def is_member():
+            return RoomMembership.objects.filter(room_id=room_id, user_id=sender_id).exists()
+
+        # Rooms joined after connecting are not in room_ids yet, so fall back to the database.
+        if room_id not in self.room_ids:
+            if not sender_id or not await is_member():
+                await self.send_event({"error": "Not a member of this room"})
+                return
+            await self.join_room(room_id)
+
+        if data.get("type") == "read":
+            message_id = data.get("message_id")
+            if not isinstance(message_id, int) or isinstance(message_id, bool):
+                await self.send_event({"error": "Invalid read receipt: integer 'message_id' required"})
+                return
+            await database_sync_to_async(RoomMembership.mark_read)(room_id, sender_id, message_id)
+            return
+
+        if "message" not in data:
+            await self.send_event({"error": "Invalid message format: 'message' key required"})
+            return
+
+        @database_sync_to_async
+        def save_room_message():
+            # Stored once per room, however many members it has.
+            msg_obj = RoomMessage.objects.create(room_id=room_id, sender_id=sender_id, message=data["message"])
+            RoomMembership.objects.filter(room_id=room_id, user_id=sender_id).update(
+                last_read_message_id=msg_obj.id
+            )
+            return msg_obj.id, msg_obj.timestamp
+
+        try:
+            with drain.track():
+                message_id, timestamp = await save_room_message()
+        except Exception as e:
+            print(f"Error in save_room_message: {str(e)}")
+            await self.send_event({"error": f"Failed to save message: {str(e)}"})
+            return
+
+        await self.channel_layer.group_send(
+            f"room_{room_id}",
+            {
+                "type": "room_message",
+                "room_id": room_id,
+                "message": data["message"],
+                "sender_id": sender_id,
+                "timestamp": timestamp.isoformat(),
+                "message_id": message_id,
+            },
+        )
+
+    async def room_message(self, event):
+        await self.send_event({
+            "room_id": event["room_id"],
+            "message": event["message"],
+            "sender_id": event["sender_id"],
+            "timestamp": event["timestamp"],
+            "message_id": event["message_id"],
+        })
+
+    async def relay_typing(self, data):
+        # Typing state lives only in the channel layer, it is never saved.
+        sender_id = self.scope["user"].id
+        if not sender_id:
+            return
+        try:
+            receiver_id = int(data.get("receiver_id"))
+        except (TypeError, ValueError):
+            await self.send_event({"error": "Invalid typing event: integer 'receiver_id' required"})
+            return
+
+        is_typing = bool(data.get("is_typing", True))
+        if not typing_throttle.allow(sender_id, receiver_id, is_typing):
+            return
+
+        await self.channel_layer.group_send(
+            f"chat_{receiver_id}",
+            {
+                "type": "typing_indicator",
+                "sender_id": sender_id,
+                "is_typing": is_typing,
+                "expires_in": typing_throttle.interval * 2,
+            },
+        )
+
+    async def typing_indicator(self, event):
+        await self.send_event({
+            "type": "typing",
+            "sender_id": event["sender_id"],
+            "is_typing": event["is_typing"],
+            "expires_in": event["expires_in"],
+        })
+
+    async def presence_update(self, event):
+        await self.send_event({
+            "type": "presence",
+            "changes": event["changes"],
+        })
+
+class ReceiptConsumer(DrainMixin, FramingMixin, AsyncJsonWebsocketConsumer):
+    """
+    Delivery and read receipts for 1:1 messages. The receiver sends
+    ``{"type": "received" | "read", "message_ids": [...]}``; every sender
+    whose messages changed gets the same frame, with the receiver's
+    ``user_id``, on their own receipts stream. A read message also counts
+    as received.
+    """
+
+    # Largest number of message ids accepted in one receipt frame.
+    max_message_ids = getattr(settings, "RECEIPT_MAX_MESSAGES", 500)
+
+    async def connect(self):
+        self.user_id = self.scope["user"].id
+        if not await self.start_drain_tracking():
+            return
+        self.rate_limiter = RateLimiter(self.user_id)
+        await self.accept_framing()
+        if self.user_id:
+            await self.channel_layer.group_add(f"receipts_{self.user_id}", self.channel_name)
+
+    async def disconnect(self, close_code):
+        self.stop_drain_tracking()
+        if self.user_id:
+            await self.channel_layer.group_discard(f"receipts_{self.user_id}", self.channel_name)
+
+    async def receive(self, text_data=None, bytes_data=None):
+        await self.receive_event(decode(text_data, bytes_data))
+
+    async def receive_event(self, data):
+        if not await self.rate_limiter.aallow("receipt"):
+            await self.send_event({"error": "Rate limit exceeded", "event": "receipt"})
+            return
+        if not self.user_id:
+            await self.send_event({"error": "Receipts need an authenticated user"})
+            return
+
+        receipt = data.get("type")
+        message_ids = data.get("message_ids")
+        if (
+            receipt not in ("received", "read")
+            or not isinstance(message_ids, list)
+            or len(message_ids) > self.max_message_ids
+            or not all(isinstance(i, int) and not isinstance(i, bool) for i in message_ids)
+        ):
+            await self.send_event({
+                "error": "Invalid receipt: 'type' must be 'received' or 'read' with a list of integer 'message_ids'"
+            })
+            return
+
+        with drain.track():
+            updated = await self.save_receipts(receipt, message_ids)
+        for sender_id, ids in updated.items():
+            await self.channel_layer.group_send(
+                f"receipts_{sender_id}",
+                {"type": "message_receipt", "receipt": receipt, "message_ids": ids, "user_id": self.user_id},
+            )
+
+    @database_sync_to_async
+    def save_receipts(self, receipt, message_ids):
+        """Flag the user's unflagged messages among ``message_ids``; returns their ids by sender."""
+        field = "is_read" if receipt == "read" else "is_received"
+        rows = list(
+            UserMessage.objects.filter(id__in=message_ids, receiver_id=self.user_id, **{field: False})
+            .values_list("id", "sender_id")
+        )
+        if not rows:
+            return {}
+        updates = {"is_received": True, "is_read": True} if receipt == "read" else {"is_received": True}
+        UserMessage.objects.filter(id__in=[message_id for message_id, _ in rows]).update(**updates)
+
+        by_sender = {}
+        for message_id, sender_id in rows:
+            by_sender.setdefault(sender_id, []).append(message_id)
+        # QuerySet.update() skips the signal that invalidates cached history.
+        for sender_id in by_sender:
+            history_cache.bump_on_commit(self.user_id, sender_id)
+        return by_sender
+
+    async def message_receipt(self, event):
+        await self.send_event({
+            "type": event["receipt"],
+            "message_ids": event["message_ids"],
+            "user_id": event["user_id"],
+        })
+
 
-class CallConsumer(WebsocketConsumer):
-    def connect(self):
-        self.accept()
+class CallConsumer(DrainMixin, FramingMixin, AsyncWebsocketConsumer):
+    # Candidates for the same peer that arrive within this window are sent
+    # as one channel-layer message; 0 forwards each one on its own.
+    ice_batch_window = getattr(settings, "CALL_ICE_BATCH_WINDOW", 0.03)
+
+    async def connect(self):
+        user = self.scope.get("user")
+        self.user_id = user.id if user else None
+        self.rate_limiter = RateLimiter(self.user_id)
+        # Older clients only understand one candidate per frame.
+        self.batch_ice = False
+        self.ice_buffers = {}
+        self.ice_flush_tasks = {}
+        if not await self.start_drain_tracking():
+            return
+        await self.accept_framing()
         print("Call WebSocket connected")
-        self.send(text_data=json.dumps({"type": "connection", "data": {"message": "connected"}}))
+        await self.send_event({"type": "connection", "data": {"message": "connected"}})
 
-    def disconnect(self, code):
+    async def disconnect(self, code):
         print(f"Call WebSocket disconnected with code {code}")
+        self.stop_drain_tracking()
+        # Candidates still waiting for their batch window go out now rather than being dropped.
+        await self.flush_ice_buffers()
+        if self.user_id:
+            peer_id = call_sessions.unregister(self.user_id, self.channel_name)
+            if peer_id is not None and call_sessions.channel_for(peer_id):
+                await self.channel_layer.send(
+                    call_sessions.channel_for(peer_id),
+                    {"type": "call_ended", "data": {"from": getattr(self, "my_name", None)}},
+                )
         if hasattr(self, "my_name"):
             print(f"Removing {self.my_name} from call groups")
-            async_to_sync(self.channel_layer.group_discard)(self.my_name, self.channel_name)
+            await self.channel_layer.group_discard(self.my_name, self.channel_name)
 
-    def receive(self, text_data):
+    async def receive(self, text_data=None, bytes_data=None):
+        await self.receive_event(decode(text_data, bytes_data))
+
+    async def receive_event(self, text_data_json):
         try:
-            text_data_json = json.loads(text_data)
             print("CallConsumer received:", text_data_json)
             event_type = text_data_json["type"]
+            if not await self.rate_limiter.aallow(event_type):
+                await self.send_event({"type": "error", "data": {"message": "Rate limit exceeded", "event": event_type}})
+                return
             print(f"CallConsumer received {event_type} event")
 
             if event_type == "login":
-                self.my_name = text_data_json["data"]["name"]
+                if self.user_id:
+                    # Authenticated sockets are registered under their own username, not a client-supplied one.
+                    self.my_name = self.scope["user"].username
+                    call_sessions.register(self.user_id, self.my_name, self.channel_name)
+                else:
+                    self.my_name = text_data_json["data"]["name"]
+                self.batch_ice = bool(text_data_json["data"].get("batch_ice", False))
                 print(f"User {self.my_name} logged in to call service")
-                async_to_sync(self.channel_layer.group_add)(self.my_name, self.channel_name)
-                self.send(text_data=json.dumps({"type": "login_success", "data": {"name": self.my_name}}))
+                await self.channel_layer.group_add(self.my_name, self.channel_name)
+                await self.send_event({
+                    "type": "login_success",
+                    "data": {"name": self.my_name, "batch_ice": self.batch_ice},
+                })
             elif event_type == "call":
                 name = text_data_json["data"]["name"]
                 print(f"User {self.my_name} is calling {name}")
                 rtc_message = text_data_json["data"]["rtcMessage"]
-                async_to_sync(self.channel_layer.group_send)(
+                callee_id = call_sessions.user_id_for(name)
+                if callee_id and call_sessions.is_busy(callee_id, self.user_id):
+                    # Leave the running call alone instead of taking it over.
+                    await self.send_event({"type": "error", "data": {"message": "User is busy", "event": event_type}})
+                    return
+                if self.user_id and callee_id:
+                    for peer_id, left_by in call_sessions.start_call(self.user_id, callee_id):
+                        if call_sessions.channel_for(peer_id):
+                            await self.flush_ice_buffer(call_sessions.name_for(peer_id))
+                            await self.channel_layer.send(
+                                call_sessions.channel_for(peer_id),
+                                {"type": "call_ended", "data": {"from": call_sessions.name_for(left_by)}},
+                            )
+                await self.send_signal(
                     name,
                     {
                         "type": "call_received",
@@ -138,12 +451,15 @@ class CallConsumer(WebsocketConsumer):
                         },
                     },
                 )
-                self.send(text_data=json.dumps({"type": "call_sent", "data": {"to": name}}))
+                await self.send_event({"type": "call_sent", "data": {"to": name}})
             elif event_type == "answer_call":
-                caller = text_data_json["data"]["caller"]
+                caller = self.resolve_peer(text_data_json["data"]["caller"])
+                if caller is None:
+                    await self.reject_target(event_type)
+                    return
                 print(f"User {self.my_name} is answering call from {caller}")
                 rtc_message = text_data_json["data"]["rtcMessage"]
-                async_to_sync(self.channel_layer.group_send)(
+                await self.send_signal(
                     caller,
                     {
                         "type": "call_answered",
@@ -151,68 +467,219 @@ class CallConsumer(WebsocketConsumer):
                     },
                 )
             elif event_type == "ICEcandidate":
-                user = text_data_json["data"]["user"]
+                user = self.resolve_peer(text_data_json["data"]["user"])
+                if user is None:
+                    await self.reject_target(event_type)
+                    return
                 print(f"Sending ICE candidate from {self.my_name} to {user}")
                 rtc_message = text_data_json["data"]["rtcMessage"]
-                async_to_sync(self.channel_layer.group_send)(
-                    user,
-                    {
-                        "type": "ICEcandidate",
-                        "data": {"rtcMessage": rtc_message},
-                    },
-                )
+                await self.queue_ice_candidate(user, rtc_message)
             elif event_type == "end_call":
-                if "data" in text_data_json and "user" in text_data_json["data"]:
-                    user = text_data_json["data"]["user"]
+                requested = (text_data_json.get("data") or {}).get("user")
+                user = self.resolve_peer(requested)
+                if self.user_id:
+                    call_sessions.end_call(self.user_id)
+                if user is not None:
                     print(f"User {self.my_name} is ending call with {user}")
-                    async_to_sync(self.channel_layer.group_send)(
+                    await self.send_signal(
                         user,
                         {"type": "call_ended", "data": {"from": self.my_name}},
                     )
+                elif requested is not None:
+                    await self.reject_target(event_type)
                 else:
-                    print(f"User {self.my_name} is ending all calls")
-                    async_to_sync(self.channel_layer.group_send)(
-                        self.my_name,
-                        {"type": "call_ended", "data": {}},
-                    )
+                    await self.flush_ice_buffers()
+                    print(f"User {self.my_name} ended a call without a peer")
         except KeyError as e:
             print("Error in CallConsumer:", str(e))
 
-    def call_received(self, event):
+    def resolve_peer(self, name=None):
+        """
+        Return the name to send call signaling to, or None if there is nobody
+        to send it to. A registered socket in a call always signals its peer,
+        and naming anyone else is refused. Other sockets fall back to the
+        name they were given, unless it belongs to a user of this worker who
+        is in a call with someone else.
+        """
+        peer_id = call_sessions.peer_of(self.user_id) if self.user_id else None
+        if peer_id is not None and call_sessions.channel_for(peer_id):
+            peer_name = call_sessions.name_for(peer_id)
+            return peer_name if name in (None, peer_name) else None
+        if name is None:
+            return None
+        target_id = call_sessions.user_id_for(name)
+        if target_id is not None and call_sessions.peer_of(target_id) not in (None, self.user_id):
+            return None
+        return name
+
+    async def reject_target(self, event_type):
+        await self.send_event({"type": "error", "data": {"message": "Not in a call with that user", "event": event_type}})
+
+    async def queue_ice_candidate(self, user, rtc_message):
+        if not self.ice_batch_window:
+            await self.send_ice_candidates(user, [rtc_message])
+            return
+        if user in self.ice_buffers:
+            self.ice_buffers[user].append(rtc_message)
+            return
+        self.ice_buffers[user] = [rtc_message]
+        self.ice_flush_tasks[user] = asyncio.ensure_future(self.flush_ice_candidates(user))
+
+    async def flush_ice_candidates(self, user):
+        await asyncio.sleep(self.ice_batch_window)
+        self.ice_flush_tasks.pop(user, None)
+        candidates = self.ice_buffers.pop(user, [])
+        if candidates:
+            await self.send_ice_candidates(user, candidates)
+
+    async def flush_ice_buffer(self, user):
+        # Send buffered candidates now, so they reach the peer before any
+        # signaling event that follows them.
+        task = self.ice_flush_tasks.pop(user, None)
+        if task is not None:
+            task.cancel()
+        candidates = self.ice_buffers.pop(user, [])
+        if candidates:
+            await self.send_ice_candidates(user, candidates)
+
+    async def flush_ice_buffers(self):
+        for user in list(self.ice_buffers):
+            await self.flush_ice_buffer(user)
+
+    async def send_signal(self, name, event):
+        await self.flush_ice_buffer(name)
+        await self.send_to_peer(name, event)
+
+    async def send_to_peer(self, name, event):
+        # Peers registered on this worker get the event on their channel
+        # directly; anyone else is reached through their name group.
+        user_id = call_sessions.user_id_for(name)
+        channel_name = call_sessions.channel_for(user_id) if user_id else None
+        if channel_name:
+            await self.channel_layer.send(channel_name, event)
+        else:
+            await self.channel_layer.group_send(name, event)
+
+    async def send_ice_candidates(self, user, candidates):
+        await self.send_to_peer(
+            user,
+            {
+                "type": "ICEcandidate",
+                "data": {"candidates": candidates},
+            },
+        )
+
+    async def call_received(self, event):
         data = event["data"]
         print(f"Call received from {data['caller']}")
-        self.send(text_data=json.dumps({
+        await self.send_event({
             "type": "call_received",
             "data": {
                 "caller": data["caller"],
                 "rtcMessage": data["rtcMessage"],
             },
-        }))
+        })
 
-    def call_answered(self, event):
+    async def call_answered(self, event):
         data = event["data"]
         print(f"Call answered, received RTC message: {data['rtcMessage']}")
-        self.send(text_data=json.dumps({
+        await self.send_event({
             "type": "call_answered",
             "data": {
                 "rtcMessage": data["rtcMessage"],
             },
-        }))
+        })
 
-    def ICEcandidate(self, event):
-        data = event["data"]
-        print(f"Received ICE candidate: {data['rtcMessage']}")
-        self.send(text_data=json.dumps({
-            "type": "ICEcandidate",
-            "data": {
-                "rtcMessage": data["rtcMessage"],
-            },
-        }))
+    async def ICEcandidate(self, event):
+        candidates = event["data"]["candidates"]
+        print(f"Received {len(candidates)} ICE candidate(s)")
+        if self.batch_ice:
+            await self.send_event({
+                "type": "ICEcandidates",
+                "data": {
+                    "candidates": candidates,
+                },
+            })
+            return
+        for rtc_message in candidates:
+            await self.send_event({
+                "type": "ICEcandidate",
+                "data": {
+                    "rtcMessage": rtc_message,
+                },
+            })
 
-    def call_ended(self, event):
+    async def call_ended(self, event):
         data = event["data"]
         print(f"Call ended, data: {data}")
-        self.send(text_data=json.dumps({
+        await self.send_event({
             "type": "call_ended",
             "data": data,
-        }))
+        })
+
+
+class MultiplexConsumer(DrainMixin, FramingMixin, AsyncWebsocketConsumer):
+    """
+    Carries the chat, receipts and call streams over a single socket.
+    Frames in both directions look like ``{"stream": "chat", "payload":
+    {...}}``; each stream is handled by an unmodified ChatConsumer,
+    ReceiptConsumer or CallConsumer that shares this socket's scope and
+    channel name.
+    """
+
+    streams = {"chat": ChatConsumer, "receipts": ReceiptConsumer, "call": CallConsumer}
+
+    async def connect(self):
+        if not await self.start_drain_tracking():
+            return
+        await self.accept_framing()
+        self.consumers = {}
+        for stream, consumer_class in self.streams.items():
+            consumer = consumer_class()
+            consumer.multiplexed = True
+            consumer.scope = self.scope
+            consumer.channel_layer = self.channel_layer
+            consumer.channel_name = self.channel_name
+            consumer.base_send = partial(self.stream_send, stream)
+            self.consumers[stream] = consumer
+            await consumer.connect()
+
+    async def disconnect(self, close_code):
+        self.stop_drain_tracking()
+        for consumer in getattr(self, "consumers", {}).values():
+            await consumer.disconnect(close_code)
+
+    async def reconnect(self, retry_after):
+        await self.send_event({"stream": "control", "payload": {"type": "reconnect", "data": {"retry_after": retry_after}}})
+        await self.close(code=SERVICE_RESTART)
+
+    async def stream_send(self, stream, message):
+        # The socket is accepted once by the multiplexer, so only data frames
+        # go out. Stream frames are already encoded, so they are wrapped
+        # without decoding them again.
+        if message["type"] != "websocket.send":
+            return
+        if message.get("bytes") is not None:
+            await self.send(bytes_data=b"\x82" + msgpack.packb("stream") + msgpack.packb(stream)
+                            + msgpack.packb("payload") + message["bytes"])
+        elif message.get("text") is not None:
+            await self.send(text_data=f'{{"stream": "{stream}", "payload": {message["text"]}}}')
+
+    async def receive(self, text_data=None, bytes_data=None):
+        try:
+            frame = decode(text_data, bytes_data)
+            consumer = self.consumers[frame["stream"]]
+            payload = frame["payload"]
+        except (KeyError, TypeError, ValueError):
+            await self.send_event({"error": "Frames need a known 'stream' and a 'payload'"})
+            return
+        await consumer.receive_event(payload)
+
+    async def dispatch(self, message):
+        # Channel-layer events are handled by whichever stream defines the handler.
+        handler_name = get_handler_name(message)
+        if not hasattr(self, handler_name):
+            for consumer in self.consumers.values():
+                if hasattr(consumer, handler_name):
+                    return await consumer.dispatch(message)
+        return await super().dispatch(message)
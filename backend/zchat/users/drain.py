@@ -0,0 +1,79 @@
+import asyncio
+import contextlib
+import random
+import weakref
+
+# Close code telling clients the worker is restarting and they should
+# reconnect. The standard 1012 is not allowed for servers to send through
+# Daphne, so it lives in the application range.
+SERVICE_RESTART = 4012
+
+
+class DrainCoordinator:
+    """
+    Tracks the sockets and in-flight message saves of this worker so a
+    shutdown can stop taking new sockets, ask clients to reconnect with a
+    random delay, and wait for pending saves before the process exits.
+    """
+
+    def __init__(self):
+        self.draining = False
+        self.inflight = 0
+        self._consumers = weakref.WeakSet()
+
+    def register(self, consumer):
+        self._consumers.add(consumer)
+
+    def unregister(self, consumer):
+        self._consumers.discard(consumer)
+
+    @contextlib.contextmanager
+    def track(self):
+        self.inflight += 1
+        try:
+            yield
+        finally:
+            self.inflight -= 1
+
+    async def drain(self, timeout=30, reconnect_jitter=10):
+        self.draining = True
+        for consumer in list(self._consumers):
+            # Spread reconnects out so the other workers are not hit all at once.
+            try:
+                await consumer.reconnect(round(random.uniform(0, reconnect_jitter), 2))
+            except Exception as e:
+                print(f"Failed to send reconnect hint: {str(e)}")
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while self.inflight and loop.time() < deadline:
+            await asyncio.sleep(0.05)
+        return self.inflight == 0
+
+    def __len__(self):
+        return len(self._consumers)
+
+
+drain = DrainCoordinator()
+
+
+class DrainMixin:
+    """Registers a consumer with the drain coordinator and refuses new sockets while draining."""
+
+    # Streams inside a MultiplexConsumer leave draining to the multiplexer.
+    multiplexed = False
+
+    async def start_drain_tracking(self):
+        if drain.draining:
+            await self.close(code=SERVICE_RESTART)
+            return False
+        if not self.multiplexed:
+            drain.register(self)
+        return True
+
+    def stop_drain_tracking(self):
+        drain.unregister(self)
+
+    async def reconnect(self, retry_after):
+        await self.send_event({"type": "reconnect", "data": {"retry_after": retry_after}})
+        await self.close(code=SERVICE_RESTART)
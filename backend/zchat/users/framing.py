@@ -0,0 +1,53 @@
+import json
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON_SUBPROTOCOL = "zchat.json"
+MSGPACK_SUBPROTOCOL = "zchat.msgpack"
+
+
+def select_subprotocol(offered):
+    """Pick the framing for a socket from the subprotocols the client offered, preferring msgpack."""
+    if MSGPACK_SUBPROTOCOL in offered and msgpack is not None:
+        return MSGPACK_SUBPROTOCOL
+    if JSON_SUBPROTOCOL in offered:
+        return JSON_SUBPROTOCOL
+    return None
+
+
+def encode(data, binary):
+    if binary:
+        return msgpack.packb(data)
+    return json.dumps(data)
+
+
+def decode(text_data=None, bytes_data=None):
+    if bytes_data is not None:
+        if msgpack is None:
+            raise ValueError("Binary frames need msgpack")
+        return msgpack.unpackb(bytes_data)
+    return json.loads(text_data)
+
+
+class FramingMixin:
+    """
+    Lets a consumer speak JSON text frames (the default, and what clients that
+    offer no subprotocol get) or msgpack binary frames, chosen with the
+    ``zchat.msgpack``/``zchat.json`` subprotocol at connect time.
+    """
+
+    binary_frames = False
+
+    async def accept_framing(self):
+        subprotocol = select_subprotocol(self.scope.get("subprotocols", []))
+        self.binary_frames = subprotocol == MSGPACK_SUBPROTOCOL
+        await self.accept(subprotocol=subprotocol)
+
+    async def send_event(self, data):
+        if self.binary_frames:
+            await self.send(bytes_data=encode(data, binary=True))
+        else:
+            await self.send(text_data=encode(data, binary=False))
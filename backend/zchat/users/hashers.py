@@ -0,0 +1,40 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.contrib.auth.hashers import PBKDF2PasswordHasher, check_password, make_password
+
+PASSWORD_HASH_ITERATIONS = getattr(settings, "PASSWORD_HASH_ITERATIONS", 0)
+PASSWORD_HASH_WORKERS = getattr(settings, "PASSWORD_HASH_WORKERS", 0)
+
+
+class ConfigurablePBKDF2PasswordHasher(PBKDF2PasswordHasher):
+    """
+    PBKDF2 with the iteration count taken from PASSWORD_HASH_ITERATIONS.
+    It keeps the ``pbkdf2_sha256`` name, so existing hashes still verify,
+    and a password stored with another count is rehashed on its next login.
+    """
+
+    iterations = PASSWORD_HASH_ITERATIONS or PBKDF2PasswordHasher.iterations
+
+
+# hashlib releases the GIL while hashing, so these threads run on separate
+# cores. The pool size caps how many cores logins can take at once.
+hash_pool = ThreadPoolExecutor(
+    max_workers=PASSWORD_HASH_WORKERS or os.cpu_count(),
+    thread_name_prefix="password-hash",
+)
+
+
+def verify_password(user, raw_password):
+    """
+    Same as ``user.check_password`` but the hashing runs in ``hash_pool``.
+    An outdated hash is replaced; the save happens in the calling thread so
+    it uses that thread's database connection.
+    """
+    outdated = []
+    valid = hash_pool.submit(check_password, raw_password, user.password, outdated.append).result()
+    if valid and outdated:
+        user.password = hash_pool.submit(make_password, raw_password).result()
+        user.save(update_fields=["password"])
+    return valid
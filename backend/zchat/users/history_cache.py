@@ -0,0 +1,65 @@
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+HISTORY_CACHE_ALIAS = getattr(settings, "HISTORY_CACHE_ALIAS", "default")
+HISTORY_CACHE_TIMEOUT = getattr(settings, "HISTORY_CACHE_TIMEOUT", 300)
+HISTORY_MAX_PAGE_SIZE = getattr(settings, "HISTORY_MAX_PAGE_SIZE", 200)
+
+
+def conversation_key(user_id, other_id):
+    low, high = sorted((int(user_id), int(other_id)))
+    return f"{low}_{high}"
+
+
+class ConversationHistoryCache:
+    """
+    Keeps a version for every 1:1 conversation and the serialized history
+    pages for the current version. The version changes whenever one of the
+    conversation's messages is saved, so a cached page is never updated in
+    place: it is simply no longer looked up and expires after ``timeout``.
+
+    The version is also the ETag of the history, which lets clients
+    revalidate without the messages table being queried.
+    """
+
+    def __init__(self, alias=None, timeout=None):
+        self.alias = alias or HISTORY_CACHE_ALIAS
+        self.timeout = timeout or HISTORY_CACHE_TIMEOUT
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get_version(self, user_id, other_id):
+        """Return the version of the conversation, starting one if the cache has none."""
+        key = f"history_version_{conversation_key(user_id, other_id)}"
+        version = self.cache.get(key)
+        if version is None:
+            self.cache.add(key, time.time_ns(), timeout=None)
+            version = self.cache.get(key)
+        return version
+
+    def bump(self, user_id, other_id):
+        # A fresh value rather than an increment, so concurrent bumps from
+        # several workers still end on a version nobody has cached pages for.
+        key = f"history_version_{conversation_key(user_id, other_id)}"
+        self.cache.set(key, time.time_ns(), timeout=None)
+
+    def bump_on_commit(self, user_id, other_id):
+        # After commit, so a reader cannot cache the old rows under the new version.
+        transaction.on_commit(lambda: self.bump(user_id, other_id))
+
+    def page_key(self, user_id, other_id, version, page):
+        return f"history_page_{conversation_key(user_id, other_id)}_{version}_{page}"
+
+    def get_page(self, user_id, other_id, version, page):
+        return self.cache.get(self.page_key(user_id, other_id, version, page))
+
+    def set_page(self, user_id, other_id, version, page, data):
+        self.cache.set(self.page_key(user_id, other_id, version, page), data, timeout=self.timeout)
+
+
+history_cache = ConversationHistoryCache()
@@ -0,0 +1,111 @@
+import asyncio
+import statistics
+import time
+
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+
+from users.consumers import ChatConsumer
+from users.models import UserMessage
+
+IN_MEMORY_CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+
+def count_server_connections():
+    if connection.vendor != "postgresql":
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT count(*) FROM pg_stat_activity WHERE datname = current_database()")
+        return cursor.fetchone()[0]
+
+
+class Command(BaseCommand):
+    help = (
+        "Open a number of ChatConsumer sockets, send a burst of messages from all of them at once "
+        "and report message latency and the number of database connections in use."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sockets", type=int, default=50)
+        parser.add_argument("--messages", type=int, default=10, help="Messages per socket.")
+        parser.add_argument(
+            "--redis", action="store_true",
+            help="Use the configured channel layer instead of an in-memory one.",
+        )
+
+    def handle(self, *args, **options):
+        User.objects.bulk_create(
+            [User(username=f"bench_db_{i}", password="!") for i in range(options["sockets"])]
+        )
+        users = list(User.objects.filter(username__startswith="bench_db_").order_by("id"))
+        try:
+            before = count_server_connections()
+            if options["redis"]:
+                latencies, peak = asyncio.run(self.burst(users, options["messages"]))
+            else:
+                with override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS):
+                    latencies, peak = asyncio.run(self.burst(users, options["messages"]))
+        finally:
+            UserMessage.objects.filter(sender__in=users).delete()
+            User.objects.filter(id__in=[user.id for user in users]).delete()
+
+        latencies.sort()
+        self.stdout.write(f"messages:        {len(latencies)}")
+        self.stdout.write(f"latency p50 (ms): {statistics.median(latencies):.2f}")
+        self.stdout.write(f"latency p95 (ms): {latencies[int(len(latencies) * 0.95) - 1]:.2f}")
+        self.stdout.write(f"latency max (ms): {latencies[-1]:.2f}")
+        if before is None:
+            self.stdout.write(f"db connections:  not reported for {connection.vendor}")
+        else:
+            self.stdout.write(f"db connections:  {before} before, {peak} peak during burst")
+
+    async def burst(self, users, messages):
+        communicators = []
+        for user in users:
+            communicator = WebsocketCommunicator(ChatConsumer.as_asgi(), "/ws/chat/bench/")
+            communicator.scope["url_route"] = {"kwargs": {"token": "bench"}}
+            communicator.scope["user"] = user
+            await communicator.connect()
+            communicators.append(communicator)
+
+        peak = 0
+        sampling = True
+
+        async def sample_connections():
+            nonlocal peak
+            while sampling:
+                peak = max(peak, await database_sync_to_async(count_server_connections)() or 0)
+                await asyncio.sleep(0.05)
+
+        async def client(index, communicator):
+            sender = users[index]
+            receiver = users[(index + 1) % len(users)]
+            latencies = []
+            for _ in range(messages):
+                start = time.perf_counter()
+                await communicator.send_json_to({
+                    "message": "benchmark",
+                    "sender_id": sender.id,
+                    "sender_username": sender.username,
+                    "receiver_id": receiver.id,
+                })
+                # Wait for the echo to our own chat group, skipping messages from the neighbour.
+                while True:
+                    event = await communicator.receive_json_from(timeout=30)
+                    if event.get("sender_id") == sender.id:
+                        break
+                latencies.append((time.perf_counter() - start) * 1000)
+            return latencies
+
+        sampler = asyncio.ensure_future(sample_connections())
+        results = await asyncio.gather(*(client(i, c) for i, c in enumerate(communicators)))
+        sampling = False
+        await sampler
+
+        for communicator in communicators:
+            await communicator.disconnect()
+        return [latency for result in results for latency in result], peak
@@ -0,0 +1,90 @@
+import time
+import zlib
+
+from django.core.management.base import BaseCommand, CommandError
+
+from users.framing import decode, encode, msgpack
+
+
+def sample_payloads():
+    sdp_lines = ["v=0", "o=- 4611731400430051336 2 IN IP4 127.0.0.1", "s=-", "t=0 0"]
+    for mid in range(3):
+        sdp_lines += [
+            "m=video 9 UDP/TLS/RTP/SAVPF 96 97 98 99 100 101 102 121 127 120 125 107 108 109",
+            "c=IN IP4 0.0.0.0",
+            f"a=mid:{mid}",
+            "a=ice-ufrag:EsAw",
+            "a=ice-pwd:bP+XJMM09aR8AiX1jdukzR6Y",
+            "a=fingerprint:sha-256 D2:FA:0E:C3:22:59:5E:14:95:69:92:3D:13:B4:84:24:2C:C2:A2:C0:3E:FD:34:8E:5E:EA:6F:AF:52:CE:E6:0F",
+        ] + [f"a=rtpmap:{pt} VP8/90000" for pt in range(96, 110)]
+    offer = {
+        "type": "call_received",
+        "data": {"caller": "alice", "rtcMessage": {"type": "offer", "sdp": "\r\n".join(sdp_lines)}},
+    }
+    chat = {
+        "message": "See you at the standup in ten minutes",
+        "sender_id": 12,
+        "receiver_id": 34,
+        "timestamp": "2026-10-19T09:41:07.123456+05:30",
+        "message_id": 918273,
+    }
+    history = [
+        {
+            "id": 900000 + i,
+            "sender": {"id": 12, "first_name": "Alice", "last_name": "A", "profile_image": None, "username": "alice"},
+            "receiver": {"id": 34, "first_name": "Bob", "last_name": "B", "profile_image": None, "username": "bob"},
+            "message": f"History message number {i}",
+            "timestamp": "2026-10-19T09:41:07.123456+05:30",
+            "is_received": True,
+            "is_read": i % 3 == 0,
+        }
+        for i in range(500)
+    ]
+    return {"sdp offer": offer, "chat message": chat, "history (500)": history}
+
+
+def deflate(data):
+    # Raw deflate stream, as permessage-deflate sends it (no zlib header).
+    compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+class Command(BaseCommand):
+    help = "Report bytes on the wire and encode/decode CPU time per message for JSON and msgpack framing."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=200)
+
+    def handle(self, *args, **options):
+        if msgpack is None:
+            raise CommandError("msgpack is not installed.")
+
+        iterations = options["iterations"]
+        self.stdout.write(
+            f"{'payload':<15} {'encoding':<9} {'bytes':>8} {'deflated':>9} {'encode us':>10} {'decode us':>10} {'deflate us':>11}"
+        )
+        for name, payload in sample_payloads().items():
+            for encoding, binary in (("json", False), ("msgpack", True)):
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    frame = encode(payload, binary)
+                encode_us = (time.perf_counter() - start) * 1e6 / iterations
+
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    if binary:
+                        decode(bytes_data=frame)
+                    else:
+                        decode(text_data=frame)
+                decode_us = (time.perf_counter() - start) * 1e6 / iterations
+
+                raw = frame if binary else frame.encode("utf8")
+                start = time.perf_counter()
+                for _ in range(iterations):
+                    deflated = deflate(raw)
+                deflate_us = (time.perf_counter() - start) * 1e6 / iterations
+
+                self.stdout.write(
+                    f"{name:<15} {encoding:<9} {len(raw):>8} {len(deflated):>9} "
+                    f"{encode_us:>10.1f} {decode_us:>10.1f} {deflate_us:>11.1f}"
+                )
@@ -0,0 +1,80 @@
+import asyncio
+import random
+
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+
+from users.consumers import CallConsumer
+
+COUNTING_CHANNEL_LAYERS = {
+    "default": {
+        "BACKEND": "users.management.commands.bench_ice_batching.CountingChannelLayer",
+        "CONFIG": {"capacity": 10000},
+    },
+}
+
+
+class CountingChannelLayer(InMemoryChannelLayer):
+    group_sends = 0
+
+    async def group_send(self, group, message):
+        self.group_sends += 1
+        await super().group_send(group, message)
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulate call setup with bursts of ICE candidates and compare channel-layer messages "
+        "and outbound frames with and without server-side batching."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--candidates", type=int, default=40, help="ICE candidates per call.")
+        parser.add_argument("--spread", type=float, default=0.2, help="Seconds over which they are sent.")
+        parser.add_argument("--windows", nargs="+", type=float, default=[0, 0.02, 0.05])
+        parser.add_argument("--seed", type=int, default=1)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'window (ms)':>12} {'layer msgs':>11} {'frames (batch_ice)':>19} {'frames (legacy)':>16}")
+        for window in options["windows"]:
+            random.seed(options["seed"])
+            with override_settings(CHANNEL_LAYERS=COUNTING_CHANNEL_LAYERS):
+                layer_messages, batched_frames = asyncio.run(
+                    self.call(window, options["candidates"], options["spread"], batch_ice=True)
+                )
+                _, legacy_frames = asyncio.run(
+                    self.call(window, options["candidates"], options["spread"], batch_ice=False)
+                )
+            self.stdout.write(f"{window * 1000:>12.0f} {layer_messages:>11} {batched_frames:>19} {legacy_frames:>16}")
+
+    async def call(self, window, candidates, spread, batch_ice):
+        consumer = type("BenchCallConsumer", (CallConsumer,), {"ice_batch_window": window})
+        layer = get_channel_layer()
+        layer.group_sends = 0
+
+        caller = WebsocketCommunicator(consumer.as_asgi(), "/ws/call/")
+        callee = WebsocketCommunicator(consumer.as_asgi(), "/ws/call/")
+        for name, communicator in (("bench_caller", caller), ("bench_callee", callee)):
+            await communicator.connect()
+            await communicator.receive_from()
+            await communicator.send_json_to({"type": "login", "data": {"name": name, "batch_ice": batch_ice}})
+            await communicator.receive_from()
+
+        # Candidates arrive in bursts as each network interface is gathered.
+        for i in range(candidates):
+            await caller.send_json_to({
+                "type": "ICEcandidate",
+                "data": {"user": "bench_callee", "rtcMessage": {"candidate": f"candidate:{i}", "sdpMid": "0"}},
+            })
+            await asyncio.sleep(random.expovariate(candidates / spread))
+
+        frames = 0
+        while not await callee.receive_nothing(timeout=max(window * 4, 0.1)):
+            await callee.receive_from()
+            frames += 1
+
+        await caller.disconnect()
+        await callee.disconnect()
+        return layer.group_sends, frames
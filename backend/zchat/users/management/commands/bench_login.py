@@ -0,0 +1,65 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+
+from users import hashers
+from users.serializers import UserLoginSerializer
+
+PASSWORD = "BenchPass123!"
+
+
+class Command(BaseCommand):
+    help = (
+        "Log in through UserLoginSerializer from a number of threads and report logins/sec, "
+        "logins/sec per core and the queries one login makes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--logins", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=8, help="Threads logging in at once.")
+        parser.add_argument("--iterations", type=int, help="PBKDF2 iterations, defaults to the configured count.")
+
+    def handle(self, *args, **options):
+        if options["iterations"]:
+            hashers.ConfigurablePBKDF2PasswordHasher.iterations = options["iterations"]
+        iterations = hashers.ConfigurablePBKDF2PasswordHasher.iterations
+
+        user = User.objects.create_user(username="bench_login", password=PASSWORD)
+        try:
+            with CaptureQueriesContext(connection) as queries:
+                self.login()
+            elapsed = self.run(options["logins"], options["concurrency"])
+        finally:
+            user.delete()
+
+        cores = min(hashers.hash_pool._max_workers, os.cpu_count())
+        rate = options["logins"] / elapsed
+        self.stdout.write(f"iterations:       {iterations}")
+        self.stdout.write(f"hash workers:     {hashers.hash_pool._max_workers} on {os.cpu_count()} cpus")
+        self.stdout.write(f"queries/login:    {len(queries)}")
+        self.stdout.write(f"logins/sec:       {rate:.1f}")
+        self.stdout.write(f"logins/sec/core:  {rate / cores:.1f}")
+
+    def login(self):
+        serializer = UserLoginSerializer(data={"username": "bench_login", "password": PASSWORD})
+        if not serializer.is_valid():
+            raise RuntimeError(serializer.errors)
+
+    def run(self, logins, concurrency):
+        def worker(count):
+            try:
+                for _ in range(count):
+                    self.login()
+            finally:
+                connections.close_all()
+
+        counts = [logins // concurrency + (i < logins % concurrency) for i in range(concurrency)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            list(executor.map(worker, counts))
+        return time.perf_counter() - start
@@ -0,0 +1,49 @@
+import asyncio
+import time
+
+from channels.layers import InMemoryChannelLayer
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare the channel-layer cost of delivering one message to a room of N members "
+        "through a single room group against one group_send per member."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", nargs="+", type=int, default=[10, 100, 1000])
+        parser.add_argument("--messages", type=int, default=50)
+
+    def handle(self, *args, **options):
+        self.stdout.write(f"{'members':>8} {'room group (ms/msg)':>20} {'per member (ms/msg)':>20} {'rows room/1:1':>14}")
+        for size in options["sizes"]:
+            room_ms = asyncio.run(self.room_fanout(size, options["messages"]))
+            member_ms = asyncio.run(self.per_member_fanout(size, options["messages"]))
+            self.stdout.write(f"{size:>8} {room_ms:>20.3f} {member_ms:>20.3f} {f'1/{size - 1}':>14}")
+
+    async def setup_layer(self, size, messages):
+        layer = InMemoryChannelLayer(capacity=messages + 1)
+        channels = [await layer.new_channel() for _ in range(size)]
+        return layer, channels
+
+    async def room_fanout(self, size, messages):
+        layer, channels = await self.setup_layer(size, messages)
+        for channel in channels:
+            await layer.group_add("room_1", channel)
+
+        start = time.perf_counter()
+        for i in range(messages):
+            await layer.group_send("room_1", {"type": "room_message", "message_id": i})
+        return (time.perf_counter() - start) * 1000 / messages
+
+    async def per_member_fanout(self, size, messages):
+        layer, channels = await self.setup_layer(size, messages)
+        for user_id, channel in enumerate(channels):
+            await layer.group_add(f"chat_{user_id}", channel)
+
+        start = time.perf_counter()
+        for i in range(messages):
+            for user_id in range(size):
+                await layer.group_send(f"chat_{user_id}", {"type": "chat_message", "message_id": i})
+        return (time.perf_counter() - start) * 1000 / messages
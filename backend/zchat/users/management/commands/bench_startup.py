@@ -0,0 +1,103 @@
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Modules a WebSocket-only worker has no use for.
+REALTIME_FORBIDDEN_MODULES = [
+    "rest_framework",
+    "rest_framework_simplejwt",
+    "django.contrib.admin",
+    "django.contrib.messages",
+    "django.contrib.staticfiles",
+    "corsheaders",
+    "whitenoise",
+    "django.core.handlers.asgi",
+]
+
+
+def parse_importtime(output):
+    """
+    Parse the stderr of ``python -X importtime`` into ``(total_us, modules)``
+    where ``modules`` maps every imported module to its cumulative time.
+    """
+    total = 0
+    modules = {}
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # Nested imports are indented, so only top level lines add to the total.
+        if not name.startswith("  "):
+            total += int(cumulative)
+        modules[name.strip()] = int(cumulative)
+    return total, modules
+
+
+def measure_import(module, settings_module=None):
+    env = dict(os.environ, DJANGO_LOAD_DOTENV="false")
+    env.pop("DJANGO_SETTINGS_MODULE", None)
+    if settings_module:
+        env["DJANGO_SETTINGS_MODULE"] = settings_module
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=settings.BASE_DIR,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode:
+        raise CommandError(f"Importing {module} failed:\n{result.stderr[-2000:]}")
+    return parse_importtime(result.stderr)
+
+
+class Command(BaseCommand):
+    help = (
+        "Import an ASGI entry point in a fresh interpreter with -X importtime and report the "
+        "import time and the slowest modules. Fails when the entry point is over --max-ms or "
+        "loads a module it should not."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--module", default="zchat.asgi_realtime")
+        parser.add_argument("--settings-module", help="DJANGO_SETTINGS_MODULE for the child process.")
+        parser.add_argument("--runs", type=int, default=5, help="The fastest run is reported.")
+        parser.add_argument("--top", type=int, default=15)
+        parser.add_argument("--max-ms", type=float, help="Fail when the import takes longer than this.")
+        parser.add_argument(
+            "--forbid", action="append",
+            help="Fail when this module gets imported. Defaults to the HTTP-only stack for zchat.asgi_realtime.",
+        )
+
+    def handle(self, *args, **options):
+        module = options["module"]
+        runs = [measure_import(module, options["settings_module"]) for _ in range(options["runs"])]
+        total, modules = min(runs, key=lambda run: run[0])
+
+        self.stdout.write(f"module:          {module}")
+        self.stdout.write(f"import time (ms): {total / 1000:.1f} (best of {len(runs)})")
+        self.stdout.write(f"modules loaded:  {len(modules)}")
+        self.stdout.write("slowest packages (cumulative ms):")
+        # Report top level packages only, their submodules are already in the cumulative time.
+        packages = {}
+        for name, cumulative in modules.items():
+            package = name.split(".")[0]
+            packages[package] = max(packages.get(package, 0), cumulative)
+        for name, cumulative in sorted(packages.items(), key=lambda item: -item[1])[:options["top"]]:
+            self.stdout.write(f"  {cumulative / 1000:8.1f}  {name}")
+
+        forbidden = options["forbid"]
+        if forbidden is None:
+            forbidden = REALTIME_FORBIDDEN_MODULES if module == "zchat.asgi_realtime" else []
+        # Match submodules too: a package imported by the app registry is not
+        # always listed on its own line.
+        loaded = [
+            name for name in forbidden
+            if any(imported == name or imported.startswith(name + ".") for imported in modules)
+        ]
+        if loaded:
+            raise CommandError(f"{module} imports {', '.join(loaded)}")
+        if options["max_ms"] is not None and total / 1000 > options["max_ms"]:
+            raise CommandError(f"{module} took {total / 1000:.1f} ms to import, budget is {options['max_ms']} ms")
@@ -0,0 +1,119 @@
+import itertools
+import random
+import time
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from users.models import Profile, UserMessage
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+WORDS = (
+    "hey hi hello ok okay sure yes no maybe thanks lol see you later tomorrow today tonight "
+    "call me when free meeting lunch coffee done sent file photo link check this out great "
+    "sounds good on my way running late almost there where are we what time can you please"
+).split()
+
+
+def zipf_cum_weights(count, skew):
+    """Cumulative weights of ranks 1..count with weight 1/rank**skew."""
+    return list(itertools.accumulate(1 / rank ** skew for rank in range(1, count + 1)))
+
+
+@contextmanager
+def explicit_timestamps():
+    # auto_now_add would stamp every generated message with the current time.
+    field = UserMessage._meta.get_field("timestamp")
+    field.auto_now_add = False
+    try:
+        yield
+    finally:
+        field.auto_now_add = True
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the configured database with synthetic users, profiles and messages. Message "
+        "traffic follows a power law over users, so a few conversations get most of the "
+        "messages. The same --seed always produces the same data."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--users", type=int, default=100000)
+        parser.add_argument("--messages", type=int, default=10000000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of user activity.")
+        parser.add_argument("--days", type=int, default=365, help="Messages are spread over this many days.")
+        parser.add_argument("--chunk-size", type=int, default=10000)
+        parser.add_argument("--prefix", default="synthetic_", help="Prefix of the generated usernames.")
+
+    def handle(self, *args, **options):
+        if options["users"] < 2:
+            raise CommandError("At least 2 users are needed to generate conversations.")
+        if User.objects.filter(username__startswith=options["prefix"]).exists():
+            raise CommandError(f"Users named {options['prefix']}* already exist; pick another --prefix.")
+
+        rng = random.Random(options["seed"])
+        start = time.perf_counter()
+        user_ids = self.create_users(options["users"], options["prefix"], options["chunk_size"])
+        self.stdout.write(f"users:    {len(user_ids)} in {time.perf_counter() - start:.1f}s")
+
+        start = time.perf_counter()
+        with explicit_timestamps():
+            count = self.create_messages(rng, user_ids, options)
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f"messages: {count} in {elapsed:.1f}s ({count / max(elapsed, 1e-9):.0f}/s)")
+
+    def create_users(self, count, prefix, chunk_size):
+        for offset in range(0, count, chunk_size):
+            with transaction.atomic():
+                users = User.objects.bulk_create(
+                    [
+                        User(username=f"{prefix}{i}", password="!", date_joined=START)
+                        for i in range(offset, min(offset + chunk_size, count))
+                    ]
+                )
+                Profile.objects.bulk_create([Profile(user_id=user.id) for user in users])
+        # Ordered by username index rather than id, so the data does not
+        # depend on the ids the database hands out.
+        ids = dict(User.objects.filter(username__startswith=prefix).values_list("username", "id"))
+        return [ids[f"{prefix}{i}"] for i in range(count)]
+
+    def create_messages(self, rng, user_ids, options):
+        total, chunk_size = options["messages"], options["chunk_size"]
+        # Activity rank of every user; rank 1 sends and receives the most.
+        ranked = list(user_ids)
+        rng.shuffle(ranked)
+        rank_of = {user_id: rank for rank, user_id in enumerate(ranked)}
+        cum_weights = zipf_cum_weights(len(ranked), options["skew"])
+        sentences = [" ".join(rng.choices(WORDS, k=rng.randint(1, 12))) for _ in range(1000)]
+        step = timedelta(days=options["days"]) / max(total, 1)
+
+        for offset in range(0, total, chunk_size):
+            size = min(chunk_size, total - offset)
+            senders = rng.choices(ranked, cum_weights=cum_weights, k=size)
+            receivers = rng.choices(ranked, cum_weights=cum_weights, k=size)
+            messages = []
+            for i, (sender_id, receiver_id) in enumerate(zip(senders, receivers)):
+                if sender_id == receiver_id:
+                    receiver_id = ranked[(rank_of[sender_id] + 1) % len(ranked)]
+                # Older messages have mostly been delivered and read.
+                age = (total - offset - i) / total
+                messages.append(
+                    UserMessage(
+                        sender_id=sender_id,
+                        receiver_id=receiver_id,
+                        message=rng.choice(sentences),
+                        timestamp=START + step * (offset + i),
+                        is_received=rng.random() < 0.5 + age,
+                        is_read=rng.random() < age,
+                    )
+                )
+            with transaction.atomic():
+                UserMessage.objects.bulk_create(messages)
+            if (offset // chunk_size) % 100 == 99:
+                self.stdout.write(f"  {offset + size}/{total}")
+        return total
@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+
+from users.revocation import revocations
+
+
+class Command(BaseCommand):
+    help = (
+        "Delete expired outstanding tokens and their blacklist entries in small batches, "
+        "so the tables used on every token refresh do not keep growing."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+        parser.add_argument(
+            "--sleep", type=float, default=0.1,
+            help="Seconds to wait between batches to leave room for other queries.",
+        )
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        expired = OutstandingToken.objects.filter(expires_at__lte=now).order_by("id")
+        outstanding = blacklisted = 0
+        while True:
+            ids = list(expired.values_list("id", flat=True)[:options["batch_size"]])
+            if not ids:
+                break
+            # Delete the blacklist rows first so the outstanding delete has
+            # nothing left to cascade to.
+            blacklisted += BlacklistedToken.objects.filter(token_id__in=ids).delete()[0]
+            outstanding += OutstandingToken.objects.filter(id__in=ids).delete()[0]
+            if options["sleep"]:
+                time.sleep(options["sleep"])
+
+        # Share a filter without the deleted tokens, so no worker has to build one.
+        revocations.rebuild()
+        self.stdout.write(f"Deleted {outstanding} outstanding and {blacklisted} blacklisted expired tokens.")
@@ -0,0 +1,87 @@
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        "Run several ASGI worker processes (zchat.server) that share one listening socket. "
+        "SIGTERM makes every worker drain its sockets before exiting."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+        parser.add_argument("--bind", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8000)
+        parser.add_argument("--backlog", type=int, default=1024)
+        parser.add_argument("--application", default="zchat.asgi:application")
+        parser.add_argument(
+            "--drain-timeout", type=float, default=float(os.getenv("WEBSOCKET_DRAIN_TIMEOUT", 30)),
+            help="Seconds workers get to finish in-flight work after SIGTERM.",
+        )
+
+    def handle(self, *args, **options):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((options["bind"], options["port"]))
+        listener.listen(options["backlog"])
+        listener.set_inheritable(True)
+
+        self.options = options
+        self.listener = listener
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.handle_stop)
+        signal.signal(signal.SIGINT, self.handle_stop)
+
+        self.workers = [self.spawn() for _ in range(options["workers"])]
+        self.stdout.write(
+            f"Listening on {options['bind']}:{options['port']} with {options['workers']} workers"
+        )
+
+        while not self.stopping:
+            for index, worker in enumerate(self.workers):
+                if worker.poll() is not None and not self.stopping:
+                    self.stderr.write(f"Worker {worker.pid} exited with {worker.returncode}, restarting")
+                    self.workers[index] = self.spawn()
+            time.sleep(0.5)
+
+        self.stop_workers()
+        listener.close()
+
+    def spawn(self):
+        env = dict(os.environ, WEBSOCKET_DRAIN_TIMEOUT=str(self.options["drain_timeout"]))
+        return subprocess.Popen(
+            [
+                sys.executable, "-m", "zchat.server",
+                "--fd", str(self.listener.fileno()),
+                self.options["application"],
+            ],
+            cwd=settings.BASE_DIR,
+            env=env,
+            pass_fds=(self.listener.fileno(),),
+        )
+
+    def handle_stop(self, signum, frame):
+        self.stopping = True
+
+    def stop_workers(self):
+        self.stdout.write("Draining workers")
+        for worker in self.workers:
+            if worker.poll() is None:
+                worker.send_signal(signal.SIGTERM)
+
+        # Give workers the drain timeout plus a little time to close cleanly.
+        deadline = time.monotonic() + self.options["drain_timeout"] + 5
+        for worker in self.workers:
+            try:
+                worker.wait(timeout=max(0, deadline - time.monotonic()))
+            except subprocess.TimeoutExpired:
+                self.stderr.write(f"Worker {worker.pid} did not drain in time, killing it")
+                worker.kill()
+                worker.wait()
@@ -1,4 +1,5 @@
 from django.db import models
+from django.db.models import Max
 from django.contrib.auth.models import User
 from django.core.validators import FileExtensionValidator
 from django.core.exceptions import ValidationError
@@ -34,3 +35,53 @@ class UserMessage(models.Model):
     def __str__(self):
         return f"{self.sender.username} to {self.receiver.username}: {self.message[:10]}"
     
+
+
+class ChatRoom(models.Model):
+    name = models.CharField(max_length=100)
+    created_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, related_name="created_rooms")
+    members = models.ManyToManyField(User, through="RoomMembership", related_name="chat_rooms")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name
+
+
+class RoomMembership(models.Model):
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name="memberships")
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="room_memberships")
+    # Id of the newest message the member has read; replaces per-message read flags.
+    last_read_message_id = models.BigIntegerField(default=0)
+    joined_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=["room", "user"], name="unique_room_member"),
+        ]
+
+    def __str__(self):
+        return f"{self.user.username} in {self.room.name}"
+
+    @classmethod
+    def mark_read(cls, room_id, user_id, message_id):
+        """Move the member's watermark forward to ``message_id``, but never past the room's newest message."""
+        newest = RoomMessage.objects.filter(room_id=room_id).aggregate(newest=Max("id"))["newest"] or 0
+        message_id = min(message_id, newest)
+        # The watermark only moves forward, so late or duplicate receipts are no-ops.
+        cls.objects.filter(room_id=room_id, user_id=user_id, last_read_message_id__lt=message_id).update(
+            last_read_message_id=message_id
+        )
+
+
+class RoomMessage(models.Model):
+    room = models.ForeignKey(ChatRoom, on_delete=models.CASCADE, related_name="messages")
+    sender = models.ForeignKey(User, on_delete=models.CASCADE, related_name="room_messages")
+
+    message = models.TextField()
+    timestamp = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=["room", "id"], name="room_message_room_id_idx")]
+
+    def __str__(self):
+        return f"{self.sender.username} in {self.room.name}: {self.message[:10]}"
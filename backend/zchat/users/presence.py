@@ -0,0 +1,195 @@
+import asyncio
+import time
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+
+from .models import UserMessage
+
+PRESENCE_TTL = getattr(settings, "PRESENCE_TTL", 60)
+PRESENCE_FLUSH_INTERVAL = getattr(settings, "PRESENCE_FLUSH_INTERVAL", 2.0)
+PRESENCE_MAX_CONNECTIONS = getattr(settings, "PRESENCE_MAX_CONNECTIONS", 16)
+PRESENCE_ROSTER_BUCKETS = getattr(settings, "PRESENCE_ROSTER_BUCKETS", 64)
+
+
+def slot_key(user_id, slot):
+    return f"presence_{user_id}_{slot}"
+
+
+def roster_key(bucket):
+    return f"presence_roster_{bucket}"
+
+
+def get_contact_ids(user_ids):
+    """Map each user id to the ids of users they have exchanged messages with."""
+    contacts = {user_id: set() for user_id in user_ids}
+    pairs = (
+        UserMessage.objects.filter(Q(sender_id__in=user_ids) | Q(receiver_id__in=user_ids))
+        .values_list("sender_id", "receiver_id")
+        .distinct()
+    )
+    for sender_id, receiver_id in pairs:
+        if sender_id in contacts:
+            contacts[sender_id].add(receiver_id)
+        if receiver_id in contacts:
+            contacts[receiver_id].add(sender_id)
+    return contacts
+
+
+class PresenceTracker:
+    """
+    Keeps the live connections of every user in the shared cache, so all
+    workers see the same picture. Each connection owns one of its user's
+    ``max_connections`` slot keys, claimed with an atomic ``add``, so tabs
+    on different workers never overwrite each other. A slot expires unless
+    it is refreshed by a heartbeat within ``ttl`` seconds.
+
+    Status changes are not broadcast one by one: they are collected and sent
+    to contacts as a single diff every ``flush_interval`` seconds. Users who
+    came online are also listed in a roster, which is swept every ``ttl``
+    seconds so users whose slots all expired without a disconnect, e.g.
+    after a worker crash, are still announced offline.
+    """
+
+    def __init__(self, ttl=None, flush_interval=None, cache_backend=None, max_connections=None, roster_buckets=None):
+        self.ttl = ttl or PRESENCE_TTL
+        self.flush_interval = flush_interval or PRESENCE_FLUSH_INTERVAL
+        self.cache = cache_backend or cache
+        self.max_connections = max_connections or PRESENCE_MAX_CONNECTIONS
+        self.roster_buckets = roster_buckets or PRESENCE_ROSTER_BUCKETS
+        # user_id -> status before the first change seen in the current batch
+        self._pending = {}
+        # channel_name -> slot it owns
+        self._local_channels = {}
+        self._flush_task = None
+        self._next_sweep = 0
+
+    async def _slots(self, user_id):
+        keys = [slot_key(user_id, slot) for slot in range(self.max_connections)]
+        return await self.cache.aget_many(keys)
+
+    def _live(self, slots, now=None):
+        now = now or time.time()
+        return {key: value for key, value in slots.items() if value[1] > now}
+
+    def _mark_changed(self, user_id, was_online):
+        self._pending.setdefault(user_id, was_online)
+
+    async def _update_roster(self, user_id, online):
+        # A lost update here only delays the sweep: every heartbeat re-adds its user.
+        key = roster_key(user_id % self.roster_buckets)
+        roster = await self.cache.aget(key) or set()
+        if (user_id in roster) == online:
+            return
+        roster = set(roster)
+        if online:
+            roster.add(user_id)
+        else:
+            roster.discard(user_id)
+        await self.cache.aset(key, roster, timeout=None)
+
+    async def _claim(self, user_id, channel_name, slots, now):
+        for slot in range(self.max_connections):
+            key = slot_key(user_id, slot)
+            value = slots.get(key)
+            if value is not None:
+                if value[1] > now:
+                    continue
+                await self.cache.adelete(key)
+            if await self.cache.aadd(key, (channel_name, now + self.ttl), timeout=self.ttl):
+                return slot
+        # Every slot is taken by another live tab, which keeps the user online anyway.
+        return None
+
+    async def is_online(self, user_id):
+        return bool(self._live(await self._slots(user_id)))
+
+    async def connect(self, user_id, channel_name):
+        self._local_channels[channel_name] = None
+        await self.heartbeat(user_id, channel_name)
+
+    async def heartbeat(self, user_id, channel_name):
+        now = time.time()
+        slots = await self._slots(user_id)
+        live = self._live(slots, now)
+        if not live:
+            self._mark_changed(user_id, False)
+
+        slot = self._local_channels.get(channel_name)
+        key = slot_key(user_id, slot) if slot is not None else None
+        if key in live and live[key][0] == channel_name:
+            await self.cache.aset(key, (channel_name, now + self.ttl), timeout=self.ttl)
+        else:
+            # Never claimed, or the slot expired and may belong to another tab now.
+            self._local_channels[channel_name] = await self._claim(user_id, channel_name, slots, now)
+        await self._update_roster(user_id, True)
+
+    async def disconnect(self, user_id, channel_name):
+        slot = self._local_channels.pop(channel_name, None)
+        if slot is None:
+            return
+        key = slot_key(user_id, slot)
+        value = await self.cache.aget(key)
+        if value is None or value[0] != channel_name or value[1] <= time.time():
+            return
+        await self.cache.adelete(key)
+        if not await self.is_online(user_id):
+            self._mark_changed(user_id, True)
+            await self._update_roster(user_id, False)
+
+    async def sweep(self):
+        """Mark users in the roster whose connections have all expired as gone offline."""
+        rosters = await self.cache.aget_many([roster_key(bucket) for bucket in range(self.roster_buckets)])
+        for roster in rosters.values():
+            for user_id in roster:
+                if not await self.is_online(user_id):
+                    self._mark_changed(user_id, True)
+                    await self._update_roster(user_id, False)
+
+    async def collect_changes(self):
+        """Return ``{user_id: online}`` for users whose status differs from the start of the batch."""
+        pending, self._pending = self._pending, {}
+        changes = {}
+        for user_id, was_online in pending.items():
+            online = await self.is_online(user_id)
+            if online != was_online:
+                changes[user_id] = online
+        return changes
+
+    async def flush(self, channel_layer):
+        changes = await self.collect_changes()
+        if not changes:
+            return 0
+
+        contacts = await database_sync_to_async(get_contact_ids)(list(changes))
+        updates = {}
+        for user_id, online in changes.items():
+            for contact_id in contacts[user_id]:
+                updates.setdefault(contact_id, {})[str(user_id)] = "online" if online else "offline"
+
+        for contact_id, diff in updates.items():
+            await channel_layer.group_send(
+                f"chat_{contact_id}",
+                {"type": "presence_update", "changes": diff},
+            )
+        return len(updates)
+
+    def start(self, channel_layer):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.ensure_future(self._run(channel_layer))
+
+    async def _run(self, channel_layer):
+        while self._local_channels or self._pending:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                if time.time() >= self._next_sweep:
+                    self._next_sweep = time.time() + self.ttl
+                    await self.sweep()
+                await self.flush(channel_layer)
+            except Exception as e:
+                print(f"Presence flush failed: {str(e)}")
+
+
+presence = PresenceTracker()
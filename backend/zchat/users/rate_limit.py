@@ -0,0 +1,132 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+DEFAULT_RATE_LIMITS = {
+    "default": {"rate": 10, "burst": 30},
+}
+
+WEBSOCKET_RATE_LIMITS = getattr(settings, "WEBSOCKET_RATE_LIMITS", DEFAULT_RATE_LIMITS)
+WEBSOCKET_USER_RATE_FACTOR = getattr(settings, "WEBSOCKET_USER_RATE_FACTOR", 3)
+WEBSOCKET_RATE_LIMIT_BACKEND = getattr(settings, "WEBSOCKET_RATE_LIMIT_BACKEND", "memory")
+
+
+def refill(tokens, updated, rate, burst, now):
+    """Return the bucket after refilling it for the time since ``updated`` and taking one token if possible."""
+    tokens = min(burst, tokens + (now - updated) * rate)
+    if tokens >= 1:
+        return tokens - 1, True
+    return tokens, False
+
+
+class MemoryBucketStore:
+    """Token buckets held in this process."""
+
+    def __init__(self):
+        self._buckets = {}
+        self._next_sweep = 0
+
+    def consume(self, key, rate, burst, now=None):
+        now = now or time.time()
+        self._expire(now)
+        tokens, updated, _ = self._buckets.get(key, (burst, now, 0))
+        tokens, allowed = refill(tokens, updated, rate, burst, now)
+        self._buckets[key] = (tokens, now, burst / rate)
+        return allowed
+
+    async def aconsume(self, key, rate, burst, now=None):
+        return self.consume(key, rate, burst, now)
+
+    def _expire(self, now):
+        # A bucket that has been idle long enough to refill is the same as no bucket.
+        if now < self._next_sweep:
+            return
+        self._buckets = {
+            key: bucket for key, bucket in self._buckets.items() if now - bucket[1] < bucket[2]
+        }
+        self._next_sweep = now + 60
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class CacheBucketStore:
+    """
+    Token buckets kept in the Django cache so every worker draws from the
+    same budget. Updates are not atomic; a few extra frames can slip through
+    when workers race, which is fine for flood protection.
+    """
+
+    def __init__(self, cache_backend=None):
+        self.cache = cache_backend or cache
+
+    def consume(self, key, rate, burst, now=None):
+        now = now or time.time()
+        tokens, updated = self.cache.get(key) or (burst, now)
+        tokens, allowed = refill(tokens, updated, rate, burst, now)
+        self.cache.set(key, (tokens, now), timeout=int(burst / rate) + 1)
+        return allowed
+
+    async def aconsume(self, key, rate, burst, now=None):
+        now = now or time.time()
+        tokens, updated = await self.cache.aget(key) or (burst, now)
+        tokens, allowed = refill(tokens, updated, rate, burst, now)
+        await self.cache.aset(key, (tokens, now), timeout=int(burst / rate) + 1)
+        return allowed
+
+
+def get_user_store():
+    if WEBSOCKET_RATE_LIMIT_BACKEND == "cache":
+        return CacheBucketStore()
+    return MemoryBucketStore()
+
+
+user_buckets = get_user_store()
+
+
+class RateLimiter:
+    """
+    Per connection limiter with a separate budget for each event type. The
+    connection bucket is checked first since it is local and cheap; the
+    user's bucket, shared by all of their sockets, is only touched after.
+    """
+
+    def __init__(self, user_id=None, limits=None, user_store=None, user_factor=None):
+        self.user_id = user_id
+        self.limits = limits or WEBSOCKET_RATE_LIMITS
+        self.user_factor = user_factor or WEBSOCKET_USER_RATE_FACTOR
+        self.connection_buckets = MemoryBucketStore()
+        self.user_store = user_buckets if user_store is None else user_store
+
+    def get_limit(self, event_type):
+        # Unknown event types share the default bucket, so clients cannot
+        # create new buckets by making up type names. Types that are not
+        # strings, e.g. a list from a malformed frame, count as unknown.
+        if not isinstance(event_type, str) or event_type not in self.limits:
+            event_type = "default"
+        limit = self.limits.get(event_type) or DEFAULT_RATE_LIMITS["default"]
+        return event_type, limit["rate"], limit["burst"]
+
+    def user_key(self, bucket):
+        return f"ratelimit_{self.user_id}_{bucket}"
+
+    def allow(self, event_type, now=None):
+        bucket, rate, burst = self.get_limit(event_type)
+        if not self.connection_buckets.consume(bucket, rate, burst, now):
+            return False
+        if self.user_id is None:
+            return True
+        return self.user_store.consume(
+            self.user_key(bucket), rate * self.user_factor, burst * self.user_factor, now
+        )
+
+    async def aallow(self, event_type, now=None):
+        bucket, rate, burst = self.get_limit(event_type)
+        if not self.connection_buckets.consume(bucket, rate, burst, now):
+            return False
+        if self.user_id is None:
+            return True
+        return await self.user_store.aconsume(
+            self.user_key(bucket), rate * self.user_factor, burst * self.user_factor, now
+        )
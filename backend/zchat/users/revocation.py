@@ -0,0 +1,174 @@
+import hashlib
+import math
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from .checks import is_shared_cache
+
+REVOCATION_BLOOM_CAPACITY = getattr(settings, "REVOCATION_BLOOM_CAPACITY", 100000)
+REVOCATION_BLOOM_ERROR_RATE = getattr(settings, "REVOCATION_BLOOM_ERROR_RATE", 0.01)
+REVOCATION_REBUILD_INTERVAL = getattr(settings, "REVOCATION_REBUILD_INTERVAL", 60)
+
+GENERATION_KEY = "revocation_generation"
+SNAPSHOT_KEY = "revocation_snapshot"
+
+
+class BloomFilter:
+    """Bit array with ``hash_count`` positions per key, sized for ``capacity`` keys at ``error_rate``."""
+
+    def __init__(self, capacity, error_rate, bits=None):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray(bits) if bits is not None else bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode("utf8"), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], "big")
+        step = int.from_bytes(digest[8:], "big") | 1
+        return [(first + i * step) % self.size for i in range(self.hash_count)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class RevocationSet:
+    """
+    Answers "is this refresh token blacklisted?" without a query for almost
+    every token. A bloom filter of the unexpired blacklisted jtis rules out
+    tokens that were never revoked; a hit, which may be a false positive, is
+    confirmed against BlacklistedToken.
+
+    Revoking bumps a generation counter in the shared cache, and every
+    worker reloads its filter when the counter moves. The filter is saved to
+    the cache, so only one worker rebuilds it from the database, in a
+    background thread: until the new filter is ready, tokens are checked
+    with the exact query. Filters are also rebuilt every
+    ``rebuild_interval`` seconds to drop expired tokens; the old one stays in
+    use meanwhile, as it still holds every revoked token.
+
+    The filter is only used with a cache shared by all workers. With a
+    per-process cache a worker would miss revocations made on the others,
+    so every token is checked with the exact query instead.
+    """
+
+    def __init__(self, capacity=None, error_rate=None, rebuild_interval=None, cache_backend=None):
+        self.capacity = capacity or REVOCATION_BLOOM_CAPACITY
+        self.error_rate = error_rate or REVOCATION_BLOOM_ERROR_RATE
+        self.rebuild_interval = rebuild_interval or REVOCATION_REBUILD_INTERVAL
+        self.cache_backend = cache_backend
+        # (generation, rebuild_at, filter), replaced as a whole so the
+        # rebuild thread never leaves a half-updated state behind.
+        self.state = None
+        self._rebuild_lock = threading.Lock()
+        self._rebuilding = False
+
+    @property
+    def cache(self):
+        return self.cache_backend or caches["default"]
+
+    def is_shared(self):
+        return is_shared_cache(self.cache)
+
+    def current_generation(self):
+        generation = self.cache.get(GENERATION_KEY)
+        if generation is None:
+            # Start from an arbitrary value so a filter built before the
+            # cache was cleared can never match.
+            self.cache.add(GENERATION_KEY, time.time_ns(), timeout=None)
+            generation = self.cache.get(GENERATION_KEY)
+        return generation
+
+    def bump(self):
+        try:
+            self.cache.incr(GENERATION_KEY)
+        except ValueError:
+            self.current_generation()
+
+    def build(self):
+        bloom = BloomFilter(self.capacity, self.error_rate)
+        jtis = BlacklistedToken.objects.filter(token__expires_at__gt=timezone.now()).values_list(
+            "token__jti", flat=True
+        )
+        for jti in jtis.iterator():
+            bloom.add(jti)
+        return bloom
+
+    def rebuild(self, now=None):
+        """Build the filter from the database and share it with the other workers."""
+        now = now or time.time()
+        # Read the generation before building, so a token revoked during
+        # the build moves the counter past it and triggers another build.
+        generation = self.current_generation()
+        bloom = self.build()
+        rebuild_at = now + self.rebuild_interval
+        self.cache.set(SNAPSHOT_KEY, (generation, rebuild_at, bytes(bloom.bits)), timeout=None)
+        self.state = (generation, rebuild_at, bloom)
+
+    def schedule_rebuild(self):
+        with self._rebuild_lock:
+            if self._rebuilding:
+                return
+            self._rebuilding = True
+        threading.Thread(target=self._rebuild_in_background, daemon=True).start()
+
+    def _rebuild_in_background(self):
+        try:
+            self.rebuild()
+        except Exception as e:
+            print(f"Failed to rebuild the revocation filter: {str(e)}")
+        finally:
+            # The thread has its own database connection; do not leak it.
+            connection.close()
+            self._rebuilding = False
+
+    def refresh(self, now=None):
+        """Return a filter holding every revoked token, or None while it is being rebuilt."""
+        now = now or time.time()
+        generation = self.current_generation()
+        state = self.state
+        if state is None or state[0] != generation:
+            snapshot = self.cache.get(SNAPSHOT_KEY)
+            if not snapshot or snapshot[0] != generation:
+                self.schedule_rebuild()
+                return None
+            _, rebuild_at, bits = snapshot
+            state = self.state = (generation, rebuild_at, BloomFilter(self.capacity, self.error_rate, bits))
+        if now >= state[1]:
+            self.schedule_rebuild()
+        return state[2]
+
+    def is_revoked(self, jti):
+        bloom = self.refresh() if self.is_shared() else None
+        if bloom is not None and jti not in bloom:
+            return False
+        return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+
+revocations = RevocationSet()
+
+
+class RevocableRefreshToken(RefreshToken):
+    """RefreshToken that checks and updates the blacklist through ``revocations``."""
+
+    def check_blacklist(self):
+        if revocations.is_revoked(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_("Token is blacklisted"))
+
+    def blacklist(self):
+        blacklisted = super().blacklist()
+        revocations.bump()
+        return blacklisted
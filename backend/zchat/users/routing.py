@@ -4,4 +4,5 @@ from . import consumers
 websocket_urlpatterns = [
     re_path(r"ws/chat/(?P<token>[^/]+)/$", consumers.ChatConsumer.as_asgi()),
     re_path(r"ws/call/$", consumers.CallConsumer.as_asgi()),
+    re_path(r"ws/multiplex/(?P<token>[^/]+)/$", consumers.MultiplexConsumer.as_asgi()),
 ]
\ No newline at end of file
@@ -1,8 +1,12 @@
-from .models import Profile, UserMessage
+from .models import ChatRoom, Profile, RoomMembership, RoomMessage, UserMessage
+from django.conf import settings
 from django.contrib.auth.models import User
 from rest_framework import serializers
+from rest_framework_simplejwt.serializers import TokenRefreshSerializer
 from django.contrib.auth.password_validation import validate_password
-from django.contrib.auth import authenticate
+from .hashers import verify_password
+from .history_cache import history_cache
+from .revocation import RevocableRefreshToken
 
 
 class UserRegisterSerializers(serializers.ModelSerializer):
@@ -52,13 +56,14 @@ class UserLoginSerializer(serializers.Serializer):
         if errors:
             raise serializers.ValidationError(errors)
         
+        # One lookup instead of get() followed by authenticate(), which
+        # fetched the same row again.
         try:
-            user_object = User.objects.get(username=attrs["username"])
+            user = User.objects.get(username=attrs["username"])
         except User.DoesNotExist:
             raise serializers.ValidationError({"username": "Username is incorrect."})
-            
-        user = authenticate(username=attrs["username"], password=attrs["password"])
-        if not user:
+
+        if not user.is_active or not verify_password(user, attrs["password"]):
             raise serializers.ValidationError({"password": "Password is incorrect."})
             
         attrs["user"] = user
@@ -66,6 +71,10 @@ class UserLoginSerializer(serializers.Serializer):
         
         
 
+class RevocableTokenRefreshSerializer(TokenRefreshSerializer):
+    token_class = RevocableRefreshToken
+
+
 class UserSerializer(serializers.ModelSerializer):
     profile_image = serializers.SerializerMethodField()
 
@@ -94,3 +103,80 @@ class UserMessageSerializer(serializers.ModelSerializer):
         model = UserMessage
         fields = ["id", "sender", "receiver", "receiver_id", "message", "timestamp", "is_received", "is_read"]
         read_only_fields = ["id", "sender", "timestamp", "is_received", "is_read"]
+
+
+class OutgoingMessageSerializer(serializers.Serializer):
+    receiver_id = serializers.IntegerField()
+    message = serializers.CharField()
+
+
+class BulkSendMessageSerializer(serializers.Serializer):
+    messages = OutgoingMessageSerializer(many=True, allow_empty=False)
+
+    def validate_messages(self, value):
+        limit = getattr(settings, "BULK_SEND_MAX_MESSAGES", 100)
+        if len(value) > limit:
+            raise serializers.ValidationError(f"At most {limit} messages per request.")
+        # One query for all receivers instead of a PrimaryKeyRelatedField lookup per message.
+        receiver_ids = {item["receiver_id"] for item in value}
+        found = set(User.objects.filter(id__in=receiver_ids).values_list("id", flat=True))
+        if found != receiver_ids:
+            raise serializers.ValidationError(f"Unknown users: {sorted(receiver_ids - found)}")
+        return value
+
+    def create(self, validated_data):
+        sender = validated_data["sender"]
+        messages = UserMessage.objects.bulk_create(
+            [
+                UserMessage(sender=sender, receiver_id=item["receiver_id"], message=item["message"])
+                for item in validated_data["messages"]
+            ]
+        )
+        # bulk_create sends no post_save, so the history versions are bumped here.
+        for receiver_id in {message.receiver_id for message in messages}:
+            history_cache.bump_on_commit(sender.id, receiver_id)
+        return messages
+
+
+class ChatRoomSerializer(serializers.ModelSerializer):
+    member_ids = serializers.ListField(
+        child=serializers.IntegerField(), write_only=True, required=False
+    )
+    member_count = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ChatRoom
+        fields = ["id", "name", "created_by", "created_at", "member_ids", "member_count"]
+        read_only_fields = ["id", "created_by", "created_at"]
+
+    def validate_member_ids(self, value):
+        member_ids = set(value)
+        found = set(User.objects.filter(id__in=member_ids).values_list("id", flat=True))
+        if found != member_ids:
+            raise serializers.ValidationError(f"Unknown users: {sorted(member_ids - found)}")
+        return member_ids
+
+    def create(self, validated_data):
+        member_ids = validated_data.pop("member_ids", set())
+        room = ChatRoom.objects.create(**validated_data)
+        member_ids = set(member_ids) | {room.created_by_id}
+        RoomMembership.objects.bulk_create(
+            [RoomMembership(room=room, user_id=user_id) for user_id in member_ids]
+        )
+        room.member_count = len(member_ids)
+        room.member_ids = member_ids
+        return room
+
+    def get_member_count(self, obj):
+        if hasattr(obj, "member_count"):
+            return obj.member_count
+        return obj.memberships.count()
+
+
+class RoomMessageSerializer(serializers.ModelSerializer):
+    sender_username = serializers.CharField(source="sender.username", read_only=True)
+
+    class Meta:
+        model = RoomMessage
+        fields = ["id", "room", "sender", "sender_username", "message", "timestamp"]
+        read_only_fields = fields
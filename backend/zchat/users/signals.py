@@ -0,0 +1,13 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .history_cache import history_cache
+from .models import UserMessage
+
+
+@receiver(post_save, sender=UserMessage)
+@receiver(post_delete, sender=UserMessage)
+def bump_history_version(sender, instance, **kwargs):
+    # New messages and receipt updates both change the history clients cache.
+    # bulk_create and QuerySet.update() skip signals and must bump themselves.
+    history_cache.bump_on_commit(instance.sender_id, instance.receiver_id)
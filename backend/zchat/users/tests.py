@@ -1,14 +1,66 @@
 from django.test import TestCase
-from django.contrib.auth.models import User
+from django.contrib.auth.models import AnonymousUser, User
 from django.urls import reverse
 from rest_framework.test import APITestCase, APIClient
 from rest_framework import status
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
 from rest_framework_simplejwt.tokens import RefreshToken
-from .models import UserMessage, Profile
+from .models import ChatRoom, Profile, RoomMembership, RoomMessage, UserMessage
+from .call_sessions import CallSessionRegistry
+from .checks import check_history_cache
+from .channel_layers import HashRing, ShardedInMemoryChannelLayer, ShardedRedisChannelLayer
+from .consumers import CallConsumer, ChatConsumer, MultiplexConsumer
+from .drain import SERVICE_RESTART, DrainCoordinator
+from .framing import JSON_SUBPROTOCOL, MSGPACK_SUBPROTOCOL, msgpack, select_subprotocol
+from .hashers import ConfigurablePBKDF2PasswordHasher
+from .history_cache import ConversationHistoryCache
+from .presence import PresenceTracker
+from .rate_limit import CacheBucketStore, MemoryBucketStore, RateLimiter
+from .revocation import BloomFilter, RevocationSet, revocations
+from .serializers import RevocableTokenRefreshSerializer, UserLoginSerializer
+from .typing_indicators import TypingThrottle
+from autobahn.websocket.compress import PerMessageDeflateOffer, PerMessageDeflateOfferAccept
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.test import override_settings
+from django.utils import timezone
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management import call_command
+from .management.commands.bench_startup import parse_importtime
+from zchat.server import accept_permessage_deflate
+from unittest import mock, skipIf
+from datetime import timedelta
+import asyncio
+import importlib.util
+import os
 import tempfile
+import time
 from PIL import Image
 import io
 
+LOCMEM_CACHES = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}}
+IN_MEMORY_CHANNEL_LAYERS = {"default": {"BACKEND": "channels.layers.InMemoryChannelLayer"}}
+
+
+class ChatSocketMixin:
+    async def connect_chat(self, user, consumer=ChatConsumer, path="/ws/chat/token/", subprotocols=None):
+        """Open a chat socket for ``user``, with presence tracking stubbed out for the rest of the test."""
+        if not hasattr(self, "presence"):
+            patcher = mock.patch("users.consumers.presence")
+            self.presence = patcher.start()
+            self.addCleanup(patcher.stop)
+            self.presence.connect = mock.AsyncMock()
+            self.presence.disconnect = mock.AsyncMock()
+
+        communicator = WebsocketCommunicator(consumer.as_asgi(), path, subprotocols=subprotocols)
+        communicator.scope["url_route"] = {"kwargs": {"token": "token"}}
+        communicator.scope["user"] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
 
 class UserRegistrationTests(APITestCase):
     def setUp(self):
@@ -73,7 +125,28 @@ class UserLoginTests(APITestCase):
         response = self.client.post(url, invalid_payload, format="json")
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
+    def test_login_looks_user_up_once(self):
+        serializer = UserLoginSerializer(data=self.valid_payload)
+        with self.assertNumQueries(1):
+            self.assertTrue(serializer.is_valid())
+        self.assertEqual(serializer.validated_data["user"], self.user)
+
+    def test_login_rehashes_when_iterations_change(self):
+        with mock.patch.object(ConfigurablePBKDF2PasswordHasher, "iterations", 1000):
+            response = self.client.post(reverse("signin"), self.valid_payload, format="json")
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.password.split("$")[1], "1000")
+        self.assertTrue(self.user.check_password("StrongPass123!"))
+
+    def test_inactive_user_cannot_login(self):
+        self.user.is_active = False
+        self.user.save()
+        response = self.client.post(reverse("signin"), self.valid_payload, format="json")
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
 
+@override_settings(CACHES=LOCMEM_CACHES)
 class UserLogoutTest(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user(
@@ -96,6 +169,94 @@ class UserLogoutTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
 
 
+@override_settings(CACHES=LOCMEM_CACHES)
+class TokenRevocationTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        revocations.state = None
+        self.user = User.objects.create_user(username="testuser", password="StrongPass@123")
+        self.refresh_token = RefreshToken.for_user(self.user)
+
+    def shared_revocation_set(self, cache_backend=None):
+        # LocMem stands in for Redis here; rebuilds run inline when a test calls rebuild().
+        revocation_set = RevocationSet(cache_backend=cache_backend) if cache_backend else revocations
+        patches = [
+            mock.patch.object(revocation_set, "is_shared", return_value=True),
+            mock.patch.object(revocation_set, "schedule_rebuild"),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        return revocation_set
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(capacity=100, error_rate=0.01)
+        for i in range(100):
+            bloom.add(f"jti-{i}")
+        self.assertTrue(all(f"jti-{i}" in bloom for i in range(100)))
+        false_positives = sum(f"other-{i}" in bloom for i in range(1000))
+        self.assertLess(false_positives, 50)
+
+    def test_refresh_skips_blacklist_query(self):
+        self.shared_revocation_set().rebuild()
+        serializer = RevocableTokenRefreshSerializer(data={"refresh": str(self.refresh_token)})
+        # Only the user lookup made by the refresh serializer itself.
+        with self.assertNumQueries(1):
+            self.assertTrue(serializer.is_valid())
+
+    def test_refresh_after_logout_is_rejected(self):
+        self.shared_revocation_set().rebuild()
+        response = self.client.post(reverse("signout"), {"refresh_token": str(self.refresh_token)}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_205_RESET_CONTENT)
+
+        # The filter is being rebuilt, so the exact query answers meanwhile.
+        response = self.client.post(reverse("token_refresh"), {"refresh": str(self.refresh_token)}, format="json")
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        revocations.schedule_rebuild.assert_called()
+
+    def test_revocation_from_other_worker(self):
+        shared = LocMemCache("revocation-test", {})
+        worker = self.shared_revocation_set(shared)
+        other = RevocationSet(cache_backend=shared)
+        jti = self.refresh_token.payload["jti"]
+        worker.rebuild()
+        self.assertFalse(worker.is_revoked(jti))
+
+        self.refresh_token.blacklist()
+        other.bump()
+        self.assertTrue(worker.is_revoked(jti))
+
+    def test_stale_filter_is_served_while_rebuilding(self):
+        revocation_set = self.shared_revocation_set()
+        revocation_set.rebuild(now=100)
+        with self.assertNumQueries(0):
+            self.assertFalse(revocation_set.is_revoked("never-revoked"))
+        revocation_set.schedule_rebuild.assert_called_once()
+
+    def test_per_process_cache_uses_exact_query(self):
+        revocation_set = RevocationSet(cache_backend=LocMemCache("revocation-local", {}))
+        self.refresh_token.blacklist()
+
+        with self.assertNumQueries(1):
+            self.assertTrue(revocation_set.is_revoked(self.refresh_token.payload["jti"]))
+        self.assertIsNone(revocation_set.state)
+
+    def test_prune_tokens(self):
+        expired = OutstandingToken.objects.create(
+            jti="expired", token="expired", expires_at=timezone.now() - timedelta(days=1)
+        )
+        BlacklistedToken.objects.create(token=expired)
+        out = io.StringIO()
+        call_command("prune_tokens", batch_size=1, sleep=0, stdout=out)
+
+        self.assertFalse(OutstandingToken.objects.filter(jti="expired").exists())
+        self.assertEqual(BlacklistedToken.objects.count(), 0)
+        self.assertEqual(OutstandingToken.objects.count(), 1)
+        self.assertIn("Deleted 1 outstanding and 1 blacklisted", out.getvalue())
+        # The command leaves a fresh filter for the workers to load.
+        self.assertEqual(cache.get("revocation_snapshot")[0], revocations.current_generation())
+
+
 class UserListTests(APITestCase):
     def setUp(self):
         self.user1 = User.objects.create_user(
@@ -128,6 +289,8 @@ class UserListTests(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
 
 
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+@override_settings(CACHES=LOCMEM_CACHES)
 class UserMessageTests(APITestCase):
     def setUp(self):
         self.user1 = User.objects.create_user(
@@ -145,6 +308,7 @@ class UserMessageTests(APITestCase):
         )
 
         self.client.force_authenticate(user=self.user1)
+        cache.clear()
 
     def test_get_conversation(self):
         url = reverse("user-messages", args=[self.user2.id])
@@ -177,3 +341,1098 @@ class UserMessageTests(APITestCase):
         response = self.client.get(url)
 
         self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def listen(self, group):
+        channel_layer = get_channel_layer()
+        async_to_sync(channel_layer.flush)()
+        channel = async_to_sync(channel_layer.new_channel)()
+        async_to_sync(channel_layer.group_add)(group, channel)
+        return lambda: async_to_sync(channel_layer.receive)(channel)
+
+    def test_send_message_notifies_receiver(self):
+        receive = self.listen(f"chat_{self.user2.id}")
+        payload = {"receiver_id": self.user2.id, "message": "Over REST"}
+        response = self.client.post(reverse("send_message"), payload, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        event = receive()
+        self.assertEqual(event["type"], "chat_message")
+        self.assertEqual(event["message"], "Over REST")
+        self.assertEqual(event["message_id"], response.data["id"])
+
+    def test_bulk_send(self):
+        user3 = User.objects.create_user(username="user3", password="StrongPass123!")
+        receive = self.listen(f"chat_{user3.id}")
+        payload = {
+            "messages": [
+                {"receiver_id": self.user2.id, "message": "one"},
+                {"receiver_id": user3.id, "message": "two"},
+                {"receiver_id": user3.id, "message": "three"},
+            ]
+        }
+        # One query to check the receivers and one INSERT for all messages.
+        with self.assertNumQueries(2):
+            response = self.client.post(reverse("send_message_bulk"), payload, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data["messages"]), 3)
+        self.assertEqual(UserMessage.objects.filter(sender=self.user1).count(), 4)
+        self.assertEqual([receive()["message"], receive()["message"]], ["two", "three"])
+
+    def test_bulk_send_rejects_unknown_receiver(self):
+        payload = {"messages": [{"receiver_id": 999, "message": "lost"}]}
+        response = self.client.post(reverse("send_message_bulk"), payload, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(UserMessage.objects.count(), 2)
+
+    @override_settings(BULK_SEND_MAX_MESSAGES=2)
+    def test_bulk_send_limit(self):
+        payload = {"messages": [{"receiver_id": self.user2.id, "message": str(i)} for i in range(3)]}
+        response = self.client.post(reverse("send_message_bulk"), payload, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+@override_settings(CACHES=LOCMEM_CACHES)
+class HistoryCacheTests(APITestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="user1", password="StrongPass123!")
+        self.user2 = User.objects.create_user(username="user2", password="StrongPass123!")
+        for i in range(5):
+            UserMessage.objects.create(sender=self.user1, receiver=self.user2, message=f"message {i}")
+        self.client.force_authenticate(user=self.user1)
+        self.url = reverse("user-messages", args=[self.user2.id])
+        cache.clear()
+
+    def check_history_cache(self, history_cache):
+        with mock.patch("users.views.history_cache", history_cache), \
+                mock.patch("users.signals.history_cache", history_cache):
+            response = self.client.get(self.url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn("Last-Modified", response)
+            etag = response["ETag"]
+
+            # Revalidation and a cached page both skip the messages table.
+            with self.assertNumQueries(1):
+                response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            with self.assertNumQueries(1):
+                response = self.client.get(self.url)
+            self.assertEqual(len(response.data), 5)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                UserMessage.objects.create(sender=self.user2, receiver=self.user1, message="reply")
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotEqual(response["ETag"], etag)
+            self.assertEqual(response.data[-1]["message"], "reply")
+
+            # A receipt update is a new version too.
+            with self.captureOnCommitCallbacks(execute=True):
+                message = UserMessage.objects.get(message="reply")
+                message.is_read = True
+                message.save()
+            response = self.client.get(self.url)
+            self.assertTrue(response.data[-1]["is_read"])
+
+    def check_history_backend(self, backend, location=""):
+        caches = {
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+            "history": {"BACKEND": backend, "LOCATION": location},
+        }
+        with override_settings(CACHES=caches):
+            self.check_history_cache(ConversationHistoryCache(alias="history"))
+
+    def test_locmem_backend(self):
+        self.check_history_backend("django.core.cache.backends.locmem.LocMemCache", "history")
+
+    def test_file_backend(self):
+        with tempfile.TemporaryDirectory() as location:
+            self.check_history_backend("django.core.cache.backends.filebased.FileBasedCache", location)
+
+    def test_system_check_requires_shared_history_cache(self):
+        redis = {"default": {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": "redis://redis:6379"}}
+        with override_settings(CACHES=redis):
+            self.assertEqual(check_history_cache(None), [])
+        with override_settings(CACHES=LOCMEM_CACHES):
+            self.assertEqual([error.id for error in check_history_cache(None)], ["users.E002"])
+        with override_settings(CACHES=redis, HISTORY_CACHE_ALIAS="history"):
+            self.assertEqual([error.id for error in check_history_cache(None)], ["users.E001"])
+
+    def test_history_page(self):
+        ids = list(UserMessage.objects.order_by("id").values_list("id", flat=True))
+        response = self.client.get(self.url, {"before": ids[4], "limit": 2})
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([message["id"] for message in response.data], ids[2:4])
+
+    def test_invalid_page_parameters(self):
+        for params in ({"before": "²"}, {"limit": "x"}, {"limit": "-1"}):
+            response = self.client.get(self.url, params)
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, params)
+
+    def test_bulk_send_bumps_version(self):
+        etag = self.client.get(self.url)["ETag"]
+        payload = {"messages": [{"receiver_id": self.user2.id, "message": "bulk"}]}
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse("send_message_bulk"), payload, format="json")
+
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 6)
+
+
+class PresenceTrackerTests(TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="user1", password="StrongPass123!")
+        self.user2 = User.objects.create_user(username="user2", password="StrongPass123!")
+        self.user3 = User.objects.create_user(username="user3", password="StrongPass123!")
+        UserMessage.objects.create(sender=self.user1, receiver=self.user2, message="Hello")
+        UserMessage.objects.create(sender=self.user3, receiver=self.user1, message="Hey")
+
+        self.channel_layer = InMemoryChannelLayer()
+        presence_cache = LocMemCache("presence-tests", {})
+        presence_cache.clear()
+        self.tracker = PresenceTracker(ttl=60, flush_interval=0.01, cache_backend=presence_cache)
+
+    def test_multiple_tabs_keep_user_online(self):
+        async_to_sync(self.tracker.connect)(self.user1.id, "tab-1")
+        async_to_sync(self.tracker.connect)(self.user1.id, "tab-2")
+        async_to_sync(self.tracker.disconnect)(self.user1.id, "tab-1")
+
+        self.assertTrue(async_to_sync(self.tracker.is_online)(self.user1.id))
+
+        async_to_sync(self.tracker.disconnect)(self.user1.id, "tab-2")
+        self.assertFalse(async_to_sync(self.tracker.is_online)(self.user1.id))
+
+    def test_connection_expires_without_heartbeat(self):
+        async_to_sync(self.tracker.connect)(self.user1.id, "tab-1")
+
+        with mock.patch("users.presence.time.time", return_value=time.time() + 61):
+            self.assertFalse(async_to_sync(self.tracker.is_online)(self.user1.id))
+
+    def test_flush_sends_one_diff_per_contact(self):
+        async_to_sync(self.channel_layer.group_add)(f"chat_{self.user2.id}", "contact-2")
+        async_to_sync(self.tracker.connect)(self.user1.id, "tab-1")
+        async_to_sync(self.tracker.connect)(self.user3.id, "tab-3")
+
+        sent = async_to_sync(self.tracker.flush)(self.channel_layer)
+        # user1 -> user2 and user3, user3 -> user1
+        self.assertEqual(sent, 3)
+
+        event = async_to_sync(self.channel_layer.receive)("contact-2")
+        self.assertEqual(event["type"], "presence_update")
+        self.assertEqual(event["changes"], {str(self.user1.id): "online"})
+
+    def test_tabs_on_different_workers_own_separate_slots(self):
+        other_worker = PresenceTracker(ttl=60, flush_interval=0.01, cache_backend=self.tracker.cache)
+        async_to_sync(self.tracker.connect)(self.user1.id, "tab-1")
+        async_to_sync(other_worker.connect)(self.user1.id, "tab-2")
+        # Refreshing one tab must not drop the other from the cache.
+        async_to_sync(self.tracker.heartbeat)(self.user1.id, "tab-1")
+        async_to_sync(other_worker.disconnect)(self.user1.id, "tab-2")
+
+        self.assertTrue(async_to_sync(self.tracker.is_online)(self.user1.id))
+
+    def test_sweep_announces_expired_connections(self):
+        async_to_sync(self.tracker.connect)(self.user1.id, "tab-1")
+        async_to_sync(self.tracker.flush)(self.channel_layer)
+        async_to_sync(self.channel_layer.group_add)(f"chat_{self.user2.id}", "contact-2")
+
+        # The worker holding tab-1 died, another one sweeps after the TTL.
+        other_worker = PresenceTracker(ttl=60, flush_interval=0.01, cache_backend=self.tracker.cache)
+        with mock.patch("users.presence.time.time", return_value=time.time() + 61):
+            async_to_sync(other_worker.sweep)()
+            async_to_sync(other_worker.flush)(self.channel_layer)
+
+        event = async_to_sync(self.channel_layer.receive)("contact-2")
+        self.assertEqual(event["changes"], {str(self.user1.id): "offline"})
+
+    def test_flapping_within_batch_is_not_broadcast(self):
+        async_to_sync(self.tracker.connect)(self.user1.id, "tab-1")
+        async_to_sync(self.tracker.flush)(self.channel_layer)
+
+        async_to_sync(self.tracker.disconnect)(self.user1.id, "tab-1")
+        async_to_sync(self.tracker.connect)(self.user1.id, "tab-2")
+
+        self.assertEqual(async_to_sync(self.tracker.flush)(self.channel_layer), 0)
+
+
+class TypingThrottleTests(TestCase):
+    def test_throttles_per_pair(self):
+        throttle = TypingThrottle(interval=2)
+
+        self.assertTrue(throttle.allow(1, 2, now=100))
+        self.assertFalse(throttle.allow(1, 2, now=101))
+        self.assertTrue(throttle.allow(1, 3, now=101))
+        self.assertTrue(throttle.allow(1, 2, now=102))
+
+    def test_state_expires(self):
+        throttle = TypingThrottle(interval=2)
+        throttle.allow(1, 2, now=100)
+        throttle.allow(3, 4, now=100)
+
+        throttle.allow(5, 6, now=105)
+        self.assertEqual(len(throttle), 1)
+
+    def test_stops_are_throttled(self):
+        throttle = TypingThrottle(interval=2)
+
+        self.assertFalse(throttle.allow(1, 2, is_typing=False, now=100))
+        self.assertTrue(throttle.allow(1, 2, now=100))
+        self.assertTrue(throttle.allow(1, 2, is_typing=False, now=100.5))
+        # Alternating frames get at most one start and one stop per interval.
+        self.assertFalse(throttle.allow(1, 2, now=101))
+        self.assertFalse(throttle.allow(1, 2, is_typing=False, now=101))
+        self.assertTrue(throttle.allow(1, 2, now=102))
+        self.assertFalse(throttle.allow(1, 2, is_typing=False, now=102.1))
+        self.assertTrue(throttle.allow(1, 2, is_typing=False, now=102.5))
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+@override_settings(CACHES=LOCMEM_CACHES)
+class TypingIndicatorConsumerTests(ChatSocketMixin, TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="user1", password="StrongPass123!")
+        self.user2 = User.objects.create_user(username="user2", password="StrongPass123!")
+
+    @mock.patch("users.consumers.typing_throttle", TypingThrottle(interval=2))
+    def test_typing_is_relayed_once_and_not_saved(self):
+        async def run():
+            channel_layer = get_channel_layer()
+            await channel_layer.group_add(f"chat_{self.user2.id}", "peer")
+
+            communicator = await self.connect_chat(self.user1)
+
+            for _ in range(5):
+                await communicator.send_json_to({"type": "typing", "receiver_id": self.user2.id})
+                await communicator.send_json_to(
+                    {"type": "typing", "receiver_id": self.user2.id, "is_typing": False}
+                )
+            await communicator.disconnect()
+
+            event = await channel_layer.receive("peer")
+            self.assertEqual(event["type"], "typing_indicator")
+            self.assertEqual(event["sender_id"], self.user1.id)
+            self.assertTrue(event["is_typing"])
+            event = await channel_layer.receive("peer")
+            self.assertFalse(event["is_typing"])
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(channel_layer.receive("peer"), timeout=0.1)
+
+        async_to_sync(run)()
+        self.assertEqual(UserMessage.objects.count(), 0)
+
+    @mock.patch("users.consumers.typing_throttle", TypingThrottle(interval=2))
+    def test_invalid_receiver_id_gets_error_frame(self):
+        async def run():
+            communicator = await self.connect_chat(self.user1)
+
+            errors = []
+            for receiver_id in (["x"], {}, "not a user"):
+                await communicator.send_json_to({"type": "typing", "receiver_id": receiver_id})
+                errors.append(await communicator.receive_json_from())
+            # The socket survives and still relays valid frames.
+            await communicator.send_json_to({"type": "typing", "receiver_id": str(self.user1.id)})
+            own = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return errors, own
+
+        errors, own = async_to_sync(run)()
+        self.assertTrue(all("receiver_id" in error["error"] for error in errors))
+        self.assertEqual(own["type"], "typing")
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class ChatRoomTests(APITestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="user1", password="StrongPass123!")
+        self.user2 = User.objects.create_user(username="user2", password="StrongPass123!")
+        self.user3 = User.objects.create_user(username="user3", password="StrongPass123!")
+
+        self.client.force_authenticate(user=self.user1)
+
+    def create_room(self):
+        url = reverse("room-list")
+        payload = {"name": "team", "member_ids": [self.user2.id, self.user3.id]}
+        return self.client.post(url, payload, format="json")
+
+    def test_create_room(self):
+        response = self.create_room()
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data["member_count"], 3)
+        self.assertEqual(RoomMembership.objects.filter(room_id=response.data["id"]).count(), 3)
+
+    def test_room_list_counts_all_members(self):
+        room_id = self.create_room().data["id"]
+
+        response = self.client.get(reverse("room-list"))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(room["id"], room["member_count"]) for room in response.data], [(room_id, 3)])
+
+    def test_create_room_with_unknown_member(self):
+        url = reverse("room-list")
+        response = self.client.post(url, {"name": "team", "member_ids": [999]}, format="json")
+
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(ChatRoom.objects.count(), 0)
+
+    def test_read_watermark_and_unread_count(self):
+        room_id = self.create_room().data["id"]
+        messages = [
+            RoomMessage.objects.create(room_id=room_id, sender=self.user2, message=f"msg {i}")
+            for i in range(3)
+        ]
+
+        url = reverse("room-read", args=[room_id])
+        self.client.post(url, {"message_id": messages[1].id}, format="json")
+        # An older receipt must not move the watermark back
+        self.client.post(url, {"message_id": messages[0].id}, format="json")
+
+        response = self.client.get(reverse("room-messages", args=[room_id]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data["messages"]), 3)
+        self.assertEqual(response.data["last_read_message_id"], messages[1].id)
+        self.assertEqual(response.data["unread_count"], 1)
+
+    def test_read_watermark_is_clamped_to_newest_message(self):
+        room_id = self.create_room().data["id"]
+        message = RoomMessage.objects.create(room_id=room_id, sender=self.user2, message="hi")
+
+        response = self.client.post(reverse("room-read", args=[room_id]), {"message_id": 10 ** 15}, format="json")
+        self.assertEqual(response.data["last_read_message_id"], message.id)
+
+    def test_non_member_cannot_read_room(self):
+        room = ChatRoom.objects.create(name="private", created_by=self.user2)
+        RoomMembership.objects.create(room=room, user=self.user2)
+
+        response = self.client.get(reverse("room-messages", args=[room.id]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+@override_settings(CACHES=LOCMEM_CACHES)
+class RoomConsumerTests(ChatSocketMixin, TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="user1", password="StrongPass123!")
+        self.user2 = User.objects.create_user(username="user2", password="StrongPass123!")
+        self.room = ChatRoom.objects.create(name="team", created_by=self.user1)
+        RoomMembership.objects.bulk_create([
+            RoomMembership(room=self.room, user=self.user1),
+            RoomMembership(room=self.room, user=self.user2),
+        ])
+
+    def test_room_message_is_stored_once_and_sent_to_room_group(self):
+        async def run():
+            communicator = await self.connect_chat(self.user1)
+
+            await communicator.send_json_to({"room_id": self.room.id, "message": "hello team"})
+            response = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return response
+
+        response = async_to_sync(run)()
+        self.assertEqual(response["room_id"], self.room.id)
+        self.assertEqual(response["message"], "hello team")
+        self.assertEqual(RoomMessage.objects.count(), 1)
+        self.assertEqual(
+            RoomMembership.objects.get(room=self.room, user=self.user1).last_read_message_id,
+            response["message_id"],
+        )
+
+    def test_read_frame_is_validated_and_clamped(self):
+        message = RoomMessage.objects.create(room=self.room, sender=self.user1, message="hi")
+
+        async def run():
+            communicator = await self.connect_chat(self.user2)
+
+            await communicator.send_json_to({"room_id": self.room.id, "type": "read"})
+            error = await communicator.receive_json_from()
+            await communicator.send_json_to({"room_id": self.room.id, "type": "read", "message_id": 10 ** 15})
+            # The socket is still open and handles the valid receipt.
+            self.assertTrue(await communicator.receive_nothing(timeout=0.2))
+            await communicator.disconnect()
+            return error
+
+        error = async_to_sync(run)()
+        self.assertIn("message_id", error["error"])
+        self.assertEqual(
+            RoomMembership.objects.get(room=self.room, user=self.user2).last_read_message_id,
+            message.id,
+        )
+
+    def test_invalid_room_id_gets_error_frame(self):
+        async def run():
+            communicator = await self.connect_chat(self.user1)
+
+            errors = []
+            for room_id in (["x"], {}, "lobby"):
+                await communicator.send_json_to({"room_id": room_id, "message": "hi"})
+                errors.append(await communicator.receive_json_from())
+            await communicator.send_json_to({"room_id": str(self.room.id), "message": "hi"})
+            message = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return errors, message
+
+        errors, message = async_to_sync(run)()
+        self.assertTrue(all("room_id" in error["error"] for error in errors))
+        self.assertEqual(message["room_id"], self.room.id)
+
+    def test_connected_member_joins_new_room(self):
+        client = APIClient()
+        client.force_authenticate(user=self.user1)
+
+        async def run():
+            communicator = await self.connect_chat(self.user2)
+
+            response = await sync_to_async(client.post)(
+                reverse("room-list"), {"name": "new", "member_ids": [self.user2.id]}, format="json"
+            )
+            joined = await communicator.receive_json_from()
+            await get_channel_layer().group_send(
+                f"room_{response.data['id']}",
+                {
+                    "type": "room_message", "room_id": response.data["id"], "message": "welcome",
+                    "sender_id": self.user1.id, "timestamp": "now", "message_id": 1,
+                },
+            )
+            message = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return response.data["id"], joined, message
+
+        room_id, joined, message = async_to_sync(run)()
+        self.assertEqual(joined, {"type": "room_joined", "room_id": room_id})
+        self.assertEqual(message["message"], "welcome")
+
+
+GROUP_POLICIES = {
+    "chat_*": {"expiry": 86400, "capacity": 100},
+    "*": {"expiry": 60, "capacity": 2},
+}
+
+
+class ShardedChannelLayerTests(TestCase):
+    def test_hash_ring_moves_few_keys_when_adding_a_shard(self):
+        keys = [f"chat_{i}" for i in range(2000)]
+        before = HashRing(range(4))
+        after = HashRing(range(5))
+
+        moved = [key for key in keys if before.get_node(key) != after.get_node(key)]
+        self.assertTrue(all(after.get_node(key) == 4 for key in moved))
+        self.assertLess(len(moved), len(keys) * 0.35)
+
+    def test_redis_layer_routing_and_policies(self):
+        layer = ShardedRedisChannelLayer(
+            hosts=["redis://shard-a:6379", "redis://shard-b:6379", "redis://shard-c:6379"],
+            group_policies=GROUP_POLICIES,
+        )
+
+        shards = {layer.consistent_hash(f"chat_{i}") for i in range(100)}
+        self.assertEqual(shards, {0, 1, 2})
+        self.assertEqual(layer.get_group_policy("chat_1"), (86400, 100))
+        self.assertEqual(layer.get_group_policy("alice"), (60, 2))
+        self.assertEqual(layer.group_expiry, 86400)
+
+    def test_process_local_channels_use_the_receivers_shard(self):
+        layer = ShardedRedisChannelLayer(
+            hosts=["redis://shard-a:6379", "redis://shard-b:6379", "redis://shard-c:6379"],
+        )
+        channels = [f"specific.{layer.client_prefix}!{i}" for i in range(100)]
+
+        # receive() looks up the shard from the non-local part of the name.
+        receiving = layer.consistent_hash(layer.non_local_name(channels[0]))
+        self.assertEqual({layer.consistent_hash(channel) for channel in channels}, {receiving})
+
+    def test_in_memory_stand_in_delivers_across_shards(self):
+        layer = ShardedInMemoryChannelLayer(shards=4, group_policies=GROUP_POLICIES)
+
+        async def run():
+            # Channels of one process share a shard, so spread them over processes.
+            channels = [f"specific.worker{i}!reply" for i in range(20)]
+            for channel in channels:
+                await layer.group_add("chat_1", channel)
+            await layer.group_send("chat_1", {"type": "chat_message"})
+            return [await layer.receive(channel) for channel in channels]
+
+        received = async_to_sync(run)()
+        self.assertEqual(len(received), 20)
+        used_shards = [shard for shard in layer.shards if shard["channels"]]
+        self.assertGreater(len(used_shards), 1)
+
+    def test_in_memory_stand_in_applies_group_capacity_and_expiry(self):
+        layer = ShardedInMemoryChannelLayer(shards=2, group_policies=GROUP_POLICIES)
+
+        async def run():
+            await layer.group_add("alice", "call.peer")
+            for _ in range(5):
+                await layer.group_send("alice", {"type": "call_received"})
+            queued = layer.shard_for("call.peer")["channels"]["call.peer"].qsize()
+
+            with mock.patch("users.channel_layers.time.time", return_value=time.time() + 61):
+                await layer.group_send("alice", {"type": "call_received"})
+            return queued
+
+        self.assertEqual(async_to_sync(run)(), 2)
+        self.assertEqual(layer.shard_for("alice")["groups"]["alice"], {})
+
+
+RATE_LIMITS = {
+    "message": {"rate": 1, "burst": 2},
+    "default": {"rate": 10, "burst": 10},
+}
+
+
+class RateLimiterTests(TestCase):
+    def test_connection_budget_per_event_type(self):
+        limiter = RateLimiter(limits=RATE_LIMITS)
+
+        self.assertTrue(limiter.allow("message", now=100))
+        self.assertTrue(limiter.allow("message", now=100))
+        self.assertFalse(limiter.allow("message", now=100))
+        # Other event types have their own bucket
+        self.assertTrue(limiter.allow("typing", now=100))
+        # One token per second refills the bucket
+        self.assertTrue(limiter.allow("message", now=101))
+
+    def test_user_budget_is_shared_between_connections(self):
+        store = CacheBucketStore(LocMemCache("rate-limit-tests", {}))
+        store.cache.clear()
+        tabs = [RateLimiter(user_id=1, limits=RATE_LIMITS, user_store=store, user_factor=2) for _ in range(3)]
+
+        allowed = [tab.allow("message", now=100) for tab in tabs for _ in range(2)]
+        self.assertEqual(allowed.count(True), 4)
+
+    def test_unknown_event_types_share_default_bucket(self):
+        store = MemoryBucketStore()
+        limiter = RateLimiter(user_id=1, limits=RATE_LIMITS, user_store=store)
+        for i in range(5):
+            limiter.allow(f"made-up-{i}", now=100)
+
+        self.assertEqual(len(limiter.connection_buckets), 1)
+        self.assertEqual(len(store), 1)
+
+    def test_non_string_event_types_use_default_bucket(self):
+        limiter = RateLimiter(limits=RATE_LIMITS)
+        for event_type in (["x"], {}, None, 3):
+            self.assertEqual(limiter.get_limit(event_type), ("default", 10, 10))
+            self.assertTrue(limiter.allow(event_type, now=100))
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+@override_settings(CACHES=LOCMEM_CACHES)
+class ChatConsumerRateLimitTests(ChatSocketMixin, TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="user1", password="StrongPass123!")
+        self.user2 = User.objects.create_user(username="user2", password="StrongPass123!")
+
+    @mock.patch("users.consumers.RateLimiter", lambda user_id: RateLimiter(user_id, limits=RATE_LIMITS, user_store=MemoryBucketStore()))
+    def test_excess_messages_are_rejected_before_saving(self):
+        async def run():
+            communicator = await self.connect_chat(self.user1)
+
+            for i in range(5):
+                await communicator.send_json_to({
+                    "message": f"flood {i}",
+                    "sender_id": self.user1.id,
+                    "sender_username": self.user1.username,
+                    "receiver_id": self.user2.id,
+                })
+            responses = [await communicator.receive_json_from() for _ in range(5)]
+            await communicator.disconnect()
+            return responses
+
+        responses = async_to_sync(run)()
+        errors = [response for response in responses if "error" in response]
+        self.assertEqual(len(errors), 3)
+        self.assertEqual(UserMessage.objects.count(), 2)
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class CallConsumerIceBatchingTests(TestCase):
+    async def login(self, name, batch_ice):
+        communicator = WebsocketCommunicator(CallConsumer.as_asgi(), "/ws/call/")
+        await communicator.connect()
+        await communicator.receive_json_from()
+        await communicator.send_json_to({"type": "login", "data": {"name": name, "batch_ice": batch_ice}})
+        await communicator.receive_json_from()
+        return communicator
+
+    def send_candidates(self, batch_ice):
+        async def run():
+            caller = await self.login("caller", batch_ice=False)
+            callee = await self.login("callee", batch_ice=batch_ice)
+            for i in range(3):
+                await caller.send_json_to({
+                    "type": "ICEcandidate",
+                    "data": {"user": "callee", "rtcMessage": {"candidate": f"candidate:{i}"}},
+                })
+
+            frames = []
+            while not await callee.receive_nothing(timeout=0.2):
+                frames.append(await callee.receive_json_from())
+            await caller.disconnect()
+            await callee.disconnect()
+            return frames
+
+        return async_to_sync(run)()
+
+    @mock.patch.object(CallConsumer, "ice_batch_window", 0.03)
+    def test_candidates_are_batched_for_new_clients(self):
+        frames = self.send_candidates(batch_ice=True)
+
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(frames[0]["type"], "ICEcandidates")
+        self.assertEqual(len(frames[0]["data"]["candidates"]), 3)
+
+    @mock.patch.object(CallConsumer, "ice_batch_window", 0.03)
+    def test_legacy_clients_get_one_frame_per_candidate(self):
+        frames = self.send_candidates(batch_ice=False)
+
+        self.assertEqual([frame["type"] for frame in frames], ["ICEcandidate"] * 3)
+        self.assertEqual(frames[2]["data"]["rtcMessage"], {"candidate": "candidate:2"})
+
+    @mock.patch.object(CallConsumer, "ice_batch_window", 10)
+    def test_buffered_candidates_are_sent_before_other_signaling(self):
+        async def run():
+            caller = await self.login("caller", batch_ice=False)
+            callee = await self.login("callee", batch_ice=True)
+            await caller.send_json_to({
+                "type": "ICEcandidate",
+                "data": {"user": "callee", "rtcMessage": {"candidate": "candidate:0"}},
+            })
+            await caller.send_json_to({"type": "end_call", "data": {"user": "callee"}})
+            await caller.send_json_to({
+                "type": "ICEcandidate",
+                "data": {"user": "callee", "rtcMessage": {"candidate": "candidate:1"}},
+            })
+            await caller.disconnect()
+
+            frames = []
+            while not await callee.receive_nothing(timeout=0.2):
+                frames.append(await callee.receive_json_from())
+            await callee.disconnect()
+            return frames
+
+        frames = async_to_sync(run)()
+        # The window never elapses: the end_call and the disconnect flush the buffer.
+        self.assertEqual([frame["type"] for frame in frames], ["ICEcandidates", "call_ended", "ICEcandidates"])
+        self.assertEqual(frames[2]["data"]["candidates"], [{"candidate": "candidate:1"}])
+
+
+class CallSessionRegistryTests(TestCase):
+    def test_call_pairs_are_cleaned_up_on_unregister(self):
+        registry = CallSessionRegistry()
+        registry.register(1, "alice", "channel-1")
+        registry.register(2, "bob", "channel-2")
+        registry.start_call(1, 2)
+
+        self.assertEqual(registry.peer_of(2), 1)
+        self.assertTrue(registry.is_busy(2, caller_id=3))
+        self.assertFalse(registry.is_busy(2, caller_id=1))
+        self.assertEqual(registry.unregister(1, "channel-1"), 2)
+        self.assertIsNone(registry.peer_of(2))
+        self.assertIsNone(registry.user_id_for("alice"))
+        self.assertEqual(len(registry), 1)
+
+    def test_start_call_reports_evicted_peers(self):
+        registry = CallSessionRegistry()
+        registry.start_call(1, 2)
+
+        self.assertEqual(registry.start_call(1, 2), [])
+        self.assertEqual(registry.start_call(1, 3), [(2, 1)])
+        self.assertIsNone(registry.peer_of(2))
+        self.assertEqual(registry.peer_of(3), 1)
+
+    def test_stale_socket_does_not_remove_newer_registration(self):
+        registry = CallSessionRegistry()
+        registry.register(1, "alice", "old-tab")
+        registry.register(1, "alice", "new-tab")
+
+        self.assertIsNone(registry.unregister(1, "old-tab"))
+        self.assertEqual(registry.channel_for(1), "new-tab")
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class CallConsumerSessionTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(username="alice", password="StrongPass123!")
+        self.bob = User.objects.create_user(username="bob", password="StrongPass123!")
+
+    async def login(self, user):
+        communicator = WebsocketCommunicator(CallConsumer.as_asgi(), "/ws/call/")
+        communicator.scope["user"] = user
+        await communicator.connect()
+        await communicator.receive_json_from()
+        await communicator.send_json_to({"type": "login", "data": {"name": "spoofed"}})
+        await communicator.receive_json_from()
+        return communicator
+
+    @mock.patch("users.consumers.call_sessions", new_callable=CallSessionRegistry)
+    def test_call_is_routed_by_user_and_ended_on_disconnect(self, registry):
+        async def run():
+            alice = await self.login(self.alice)
+            bob = await self.login(self.bob)
+
+            await alice.send_json_to({"type": "call", "data": {"name": "bob", "rtcMessage": {"sdp": "offer"}}})
+            await alice.receive_json_from()
+            call = await bob.receive_json_from()
+            self.assertEqual(registry.peer_of(self.bob.id), self.alice.id)
+
+            await alice.disconnect()
+            ended = await bob.receive_json_from()
+            await bob.disconnect()
+            return call, ended
+
+        call, ended = async_to_sync(run)()
+        self.assertEqual(call["data"]["caller"], "alice")
+        self.assertEqual(ended, {"type": "call_ended", "data": {"from": "alice"}})
+        self.assertEqual(len(registry), 0)
+
+    @mock.patch("users.consumers.call_sessions", new_callable=CallSessionRegistry)
+    def test_calling_a_busy_user_leaves_their_call_alone(self, registry):
+        carol_user = User.objects.create_user(username="carol", password="StrongPass123!")
+
+        async def run():
+            alice = await self.login(self.alice)
+            bob = await self.login(self.bob)
+            carol = await self.login(carol_user)
+            await alice.send_json_to({"type": "call", "data": {"name": "bob", "rtcMessage": {"sdp": "offer"}}})
+            await alice.receive_json_from()
+            await bob.receive_json_from()
+
+            await carol.send_json_to({"type": "call", "data": {"name": "bob", "rtcMessage": {"sdp": "offer"}}})
+            busy = await carol.receive_json_from()
+            self.assertTrue(await bob.receive_nothing(timeout=0.1))
+
+            # Alice and Bob can still signal each other.
+            await bob.send_json_to({"type": "answer_call", "data": {"caller": "alice", "rtcMessage": {"sdp": "answer"}}})
+            answered = await alice.receive_json_from()
+
+            # Alice moving on to Carol tells Bob the call ended.
+            await alice.send_json_to({"type": "call", "data": {"name": "carol", "rtcMessage": {"sdp": "offer"}}})
+            ended = await bob.receive_json_from()
+            for communicator in (alice, bob, carol):
+                await communicator.disconnect()
+            return busy, answered, ended
+
+        busy, answered, ended = async_to_sync(run)()
+        self.assertEqual(busy, {"type": "error", "data": {"message": "User is busy", "event": "call"}})
+        self.assertEqual(answered["type"], "call_answered")
+        self.assertEqual(ended, {"type": "call_ended", "data": {"from": "alice"}})
+
+    @mock.patch("users.consumers.call_sessions", new_callable=CallSessionRegistry)
+    def test_signaling_only_reaches_the_call_peer(self, registry):
+        carol_user = User.objects.create_user(username="carol", password="StrongPass123!")
+
+        async def run():
+            alice = await self.login(self.alice)
+            bob = await self.login(self.bob)
+            carol = await self.login(carol_user)
+
+            await alice.send_json_to({"type": "call", "data": {"name": "bob", "rtcMessage": {"sdp": "offer"}}})
+            await alice.receive_json_from()
+            await bob.receive_json_from()
+
+            # A third user cannot answer or send candidates into the call.
+            await carol.send_json_to({"type": "answer_call", "data": {"caller": "alice", "rtcMessage": {"sdp": "x"}}})
+            carol_error = await carol.receive_json_from()
+            # Nor can the callee aim its signaling at anyone but the caller.
+            await bob.send_json_to({"type": "ICEcandidate", "data": {"user": "carol", "rtcMessage": {"c": 1}}})
+            bob_error = await bob.receive_json_from()
+            self.assertTrue(await alice.receive_nothing(timeout=0.1))
+            self.assertTrue(await carol.receive_nothing(timeout=0.1))
+
+            await bob.send_json_to({"type": "answer_call", "data": {"caller": "alice", "rtcMessage": {"sdp": "answer"}}})
+            answered = await alice.receive_json_from()
+
+            # Without a target the call is ended with the peer, and ending
+            # it again reaches nobody, not even the user's own name group.
+            await alice.send_json_to({"type": "end_call"})
+            ended = await bob.receive_json_from()
+            await bob.send_json_to({"type": "end_call"})
+            self.assertTrue(await alice.receive_nothing(timeout=0.1))
+            self.assertTrue(await bob.receive_nothing(timeout=0.1))
+
+            for communicator in (alice, bob, carol):
+                await communicator.disconnect()
+            return carol_error, bob_error, answered, ended
+
+        carol_error, bob_error, answered, ended = async_to_sync(run)()
+        self.assertEqual(carol_error["type"], "error")
+        self.assertEqual(bob_error["data"]["event"], "ICEcandidate")
+        self.assertEqual(answered["data"]["rtcMessage"], {"sdp": "answer"})
+        self.assertEqual(ended, {"type": "call_ended", "data": {"from": "alice"}})
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+@override_settings(CACHES=LOCMEM_CACHES)
+class MultiplexConsumerTests(ChatSocketMixin, TestCase):
+    def setUp(self):
+        self.user1 = User.objects.create_user(username="user1", password="StrongPass123!")
+        self.user2 = User.objects.create_user(username="user2", password="StrongPass123!")
+
+    def test_chat_and_call_share_one_socket(self):
+        async def run():
+            communicator = await self.connect_chat(self.user1, consumer=MultiplexConsumer, path="/ws/multiplex/token/")
+            frames = [await communicator.receive_json_from()]
+
+            await communicator.send_json_to({"stream": "call", "payload": {"type": "login", "data": {"name": "user1"}}})
+            frames.append(await communicator.receive_json_from())
+
+            await communicator.send_json_to({
+                "stream": "chat",
+                "payload": {
+                    "message": "hello",
+                    "sender_id": self.user1.id,
+                    "sender_username": "user1",
+                    "receiver_id": self.user2.id,
+                },
+            })
+            frames.append(await communicator.receive_json_from())
+
+            await communicator.send_json_to({"payload": {}})
+            frames.append(await communicator.receive_json_from())
+            await communicator.disconnect()
+            return frames
+
+        connection, login, chat, error = async_to_sync(run)()
+        self.assertEqual(connection["stream"], "call")
+        self.assertEqual(connection["payload"]["type"], "connection")
+        self.assertEqual(login, {"stream": "call", "payload": {"type": "login_success", "data": {"name": "user1", "batch_ice": False}}})
+        self.assertEqual(chat["stream"], "chat")
+        self.assertEqual(chat["payload"]["message"], "hello")
+        self.assertIn("error", error)
+
+    def test_receipts_stream_updates_messages_and_notifies_sender(self):
+        messages = [UserMessage.objects.create(sender=self.user1, receiver=self.user2, message=f"m{i}") for i in range(2)]
+        # Not sent to user2, so user2's receipt must not touch it.
+        other = UserMessage.objects.create(sender=self.user2, receiver=self.user1, message="mine")
+        ids = [message.id for message in messages]
+
+        async def run():
+            sender = await self.connect_chat(self.user1, consumer=MultiplexConsumer, path="/ws/multiplex/token/")
+            receiver = await self.connect_chat(self.user2, consumer=MultiplexConsumer, path="/ws/multiplex/token/")
+            await sender.receive_json_from()
+            await receiver.receive_json_from()
+
+            await receiver.send_json_to({"stream": "receipts", "payload": {"type": "received", "message_ids": ids}})
+            received = await sender.receive_json_from()
+            await receiver.send_json_to({"stream": "receipts", "payload": {"type": "read", "message_ids": ids + [other.id]}})
+            read = await sender.receive_json_from()
+            # Nothing changed, so nobody is notified.
+            await receiver.send_json_to({"stream": "receipts", "payload": {"type": "read", "message_ids": ids}})
+            self.assertTrue(await sender.receive_nothing(timeout=0.1))
+            await receiver.send_json_to({"stream": "receipts", "payload": {"room_id": 1, "message": "x"}})
+            error = await receiver.receive_json_from()
+
+            await sender.disconnect()
+            await receiver.disconnect()
+            return received, read, error
+
+        received, read, error = async_to_sync(run)()
+        self.assertEqual(
+            received, {"stream": "receipts", "payload": {"type": "received", "message_ids": ids, "user_id": self.user2.id}}
+        )
+        self.assertEqual(read["payload"]["type"], "read")
+        self.assertEqual(sorted(read["payload"]["message_ids"]), ids)
+        self.assertEqual(error["stream"], "receipts")
+        self.assertIn("Invalid receipt", error["payload"]["error"])
+        self.assertEqual(UserMessage.objects.filter(id__in=ids, is_received=True, is_read=True).count(), 2)
+        other.refresh_from_db()
+        self.assertFalse(other.is_read)
+
+
+class FramingTests(ChatSocketMixin, TestCase):
+    def test_select_subprotocol(self):
+        self.assertIsNone(select_subprotocol([]))
+        self.assertEqual(select_subprotocol([JSON_SUBPROTOCOL]), JSON_SUBPROTOCOL)
+        with mock.patch("users.framing.msgpack", None):
+            self.assertEqual(select_subprotocol([MSGPACK_SUBPROTOCOL, JSON_SUBPROTOCOL]), JSON_SUBPROTOCOL)
+
+    @skipIf(msgpack is None, "msgpack is not installed")
+    @override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+    def test_call_consumer_binary_frames(self):
+        async def run():
+            communicator = WebsocketCommunicator(
+                CallConsumer.as_asgi(), "/ws/call/", subprotocols=[MSGPACK_SUBPROTOCOL, JSON_SUBPROTOCOL]
+            )
+            connected, subprotocol = await communicator.connect()
+            greeting = msgpack.unpackb(await communicator.receive_from())
+            await communicator.send_to(bytes_data=msgpack.packb({"type": "login", "data": {"name": "alice"}}))
+            login = msgpack.unpackb(await communicator.receive_from())
+            await communicator.disconnect()
+            return subprotocol, greeting, login
+
+        subprotocol, greeting, login = async_to_sync(run)()
+        self.assertEqual(subprotocol, MSGPACK_SUBPROTOCOL)
+        self.assertEqual(greeting["type"], "connection")
+        self.assertEqual(login["data"]["name"], "alice")
+
+    @skipIf(msgpack is None, "msgpack is not installed")
+    @override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+    def test_multiplexed_binary_frames_are_tagged(self):
+        async def run():
+            communicator = await self.connect_chat(
+                AnonymousUser(), consumer=MultiplexConsumer, path="/ws/multiplex/token/",
+                subprotocols=[MSGPACK_SUBPROTOCOL],
+            )
+            frame = msgpack.unpackb(await communicator.receive_from())
+            await communicator.disconnect()
+            return frame
+
+        frame = async_to_sync(run)()
+        self.assertEqual(frame, {"stream": "call", "payload": {"type": "connection", "data": {"message": "connected"}}})
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class PermessageDeflateTests(TestCase):
+    def test_deflate_offer_is_accepted_with_mem_level_from_env(self):
+        offer = PerMessageDeflateOffer()
+        with mock.patch.dict(os.environ, {"WEBSOCKET_DEFLATE_MEM_LEVEL": "4"}):
+            accept = accept_permessage_deflate([offer])
+
+        self.assertIsInstance(accept, PerMessageDeflateOfferAccept)
+        self.assertIs(accept.offer, offer)
+        self.assertEqual(accept.mem_level, 4)
+
+    def test_default_mem_level_and_no_offer(self):
+        with mock.patch.dict(os.environ):
+            os.environ.pop("WEBSOCKET_DEFLATE_MEM_LEVEL", None)
+            self.assertIsNone(accept_permessage_deflate([PerMessageDeflateOffer()]).mem_level)
+        self.assertIsNone(accept_permessage_deflate([]))
+
+
+@override_settings(CHANNEL_LAYERS=IN_MEMORY_CHANNEL_LAYERS)
+class DrainTests(TestCase):
+    def test_drain_sends_reconnect_hint_and_refuses_new_sockets(self):
+        coordinator = DrainCoordinator()
+
+        async def run():
+            communicator = WebsocketCommunicator(CallConsumer.as_asgi(), "/ws/call/")
+            await communicator.connect()
+            await communicator.receive_json_from()
+            self.assertEqual(len(coordinator), 1)
+
+            drained = await coordinator.drain(timeout=1, reconnect_jitter=5)
+            hint = await communicator.receive_json_from()
+            closed = await communicator.receive_output()
+
+            late = WebsocketCommunicator(CallConsumer.as_asgi(), "/ws/call/")
+            connected, code = await late.connect()
+            return drained, hint, closed, connected, code
+
+        with mock.patch("users.drain.drain", coordinator):
+            drained, hint, closed, connected, code = async_to_sync(run)()
+
+        self.assertTrue(drained)
+        self.assertEqual(hint["type"], "reconnect")
+        self.assertLessEqual(hint["data"]["retry_after"], 5)
+        self.assertEqual(closed, {"type": "websocket.close", "code": SERVICE_RESTART})
+        self.assertFalse(connected)
+        self.assertEqual(code, SERVICE_RESTART)
+
+    def test_drain_waits_for_inflight_work(self):
+        coordinator = DrainCoordinator()
+
+        async def run():
+            async def save():
+                with coordinator.track():
+                    await asyncio.sleep(0.1)
+
+            task = asyncio.ensure_future(save())
+            await asyncio.sleep(0)
+            drained = await coordinator.drain(timeout=1)
+            return drained, task.done()
+
+        self.assertEqual(async_to_sync(run)(), (True, True))
+
+
+class StartupImportTests(TestCase):
+    def test_parse_importtime(self):
+        output = (
+            "import time: self [us] | cumulative | imported package\n"
+            "import time:       100 |        100 |   users.presence\n"
+            "import time:       200 |        300 | users.consumers\n"
+            "import time:        50 |         50 | gc\n"
+        )
+        total, modules = parse_importtime(output)
+        self.assertEqual(total, 350)
+        self.assertEqual(modules["users.presence"], 100)
+
+    def test_realtime_entry_point_stays_slim(self):
+        out = io.StringIO()
+        with mock.patch.dict(os.environ, {"SECRET_KEY": "test"}):
+            # Raises CommandError if DRF, admin or the HTTP handler get imported.
+            call_command("bench_startup", runs=1, top=1, stdout=out)
+        self.assertIn("zchat.asgi_realtime", out.getvalue())
+
+
+def load_database_settings(**env):
+    """Run zchat/settings.py afresh with ``env`` and return its default database."""
+    import zchat.settings
+
+    with mock.patch.dict(os.environ, {"DJANGO_LOAD_DOTENV": "false", **env}):
+        for name in ("DATABASE_CONN_MAX_AGE", "DATABASE_POOL"):
+            if name not in env:
+                os.environ.pop(name, None)
+        spec = importlib.util.spec_from_file_location("settings_under_test", zchat.settings.__file__)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+    return module.DATABASES["default"]
+
+
+try:
+    import psycopg_pool
+except ImportError:
+    psycopg_pool = None
+
+
+class DatabaseSettingsTests(TestCase):
+    def test_connections_are_not_persistent_by_default(self):
+        database = load_database_settings()
+        self.assertEqual(database["CONN_MAX_AGE"], 0)
+        self.assertNotIn("pool", database["OPTIONS"])
+
+    def test_conn_max_age_from_env(self):
+        self.assertEqual(load_database_settings(DATABASE_CONN_MAX_AGE="30")["CONN_MAX_AGE"], 30)
+
+    @skipIf(psycopg_pool is None, "psycopg_pool is not installed")
+    def test_pool_forces_conn_max_age_to_zero(self):
+        database = load_database_settings(
+            DATABASE_POOL="true", DATABASE_CONN_MAX_AGE="30", DATABASE_POOL_MAX_SIZE="4"
+        )
+        self.assertEqual(database["CONN_MAX_AGE"], 0)
+        self.assertEqual(database["OPTIONS"]["pool"]["max_size"], 4)
+        self.assertEqual(database["OPTIONS"]["pool"]["check"], psycopg_pool.ConnectionPool.check_connection)
+
+
+class GenerateDataTests(TestCase):
+    def generate(self, prefix, seed=7):
+        call_command(
+            "generate_data", users=30, messages=600, seed=seed, chunk_size=100, prefix=prefix, stdout=io.StringIO()
+        )
+        messages = UserMessage.objects.filter(sender__username__startswith=prefix).order_by("id")
+        return [
+            (m.sender.username[len(prefix):], m.receiver.username[len(prefix):], m.message, m.timestamp)
+            for m in messages.select_related("sender", "receiver")
+        ]
+
+    def test_same_seed_same_data(self):
+        first = self.generate("a_")
+        self.assertEqual(len(first), 600)
+        self.assertEqual(first, self.generate("b_"))
+        self.assertNotEqual(first, self.generate("c_", seed=8))
+        self.assertEqual(Profile.objects.filter(user__username__startswith="a_").count(), 30)
+
+    def test_conversations_are_skewed(self):
+        messages = self.generate("skew_")
+        self.assertTrue(all(sender != receiver for sender, receiver, _, _ in messages))
+        counts = {}
+        for sender, receiver, _, _ in messages:
+            pair = tuple(sorted((sender, receiver)))
+            counts[pair] = counts.get(pair, 0) + 1
+        # The busiest conversation gets many times its even share.
+        self.assertGreater(max(counts.values()), 5 * len(messages) / len(counts))
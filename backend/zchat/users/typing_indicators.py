@@ -0,0 +1,57 @@
+import time
+
+from django.conf import settings
+
+TYPING_THROTTLE_INTERVAL = getattr(settings, "TYPING_THROTTLE_INTERVAL", 2.0)
+
+
+class TypingThrottle:
+    """
+    Lets at most one "started typing" and one "stopped typing" event per
+    sender/receiver pair through every ``interval`` seconds. A stop is only
+    relayed when the last relayed event was a start, so alternating frames
+    cannot get around the throttle. Nothing is persisted: entries are
+    dropped once the receiver's indicator would have expired on its own
+    (two intervals).
+    """
+
+    def __init__(self, interval=None):
+        self.interval = interval or TYPING_THROTTLE_INTERVAL
+        # (sender_id, receiver_id) -> (last relayed state, last start, last stop)
+        self._last_sent = {}
+        self._next_sweep = 0
+
+    def allow(self, sender_id, receiver_id, is_typing=True, now=None):
+        now = now or time.monotonic()
+        self._expire(now)
+
+        key = (sender_id, receiver_id)
+        typing, last_start, last_stop = self._last_sent.get(key, (False, None, None))
+        if is_typing:
+            if last_start is not None and now - last_start < self.interval:
+                return False
+            self._last_sent[key] = (True, now, last_stop)
+            return True
+
+        # Nothing to stop if the receiver was not shown a start.
+        if not typing:
+            return False
+        if last_stop is not None and now - last_stop < self.interval:
+            return False
+        self._last_sent[key] = (False, last_start, now)
+        return True
+
+    def _expire(self, now):
+        if now < self._next_sweep:
+            return
+        self._last_sent = {
+            key: entry for key, entry in self._last_sent.items()
+            if now - max(t for t in entry[1:] if t is not None) < self.interval * 2
+        }
+        self._next_sweep = now + self.interval
+
+    def __len__(self):
+        return len(self._last_sent)
+
+
+typing_throttle = TypingThrottle()
@@ -1,5 +1,16 @@
 from django.urls import path
-from .views import SendMessageView, UserListView, UserLoginView, UserLogoutView, UserMessageView, UserRegistrationView
+from .views import (
+    BulkSendMessageView,
+    ChatRoomListView,
+    RoomMessageView,
+    RoomReadView,
+    SendMessageView,
+    UserListView,
+    UserLoginView,
+    UserLogoutView,
+    UserMessageView,
+    UserRegistrationView,
+)
 
 urlpatterns = [
     path("signup/", UserRegistrationView.as_view(), name="signup"),
@@ -8,4 +19,8 @@ urlpatterns = [
     path("list/", UserListView.as_view(), name="user-list"),
     path("messages/<int:user_id>/", UserMessageView.as_view(), name="user-messages"),
     path("send/", SendMessageView.as_view(), name="send_message"),
+    path("send/bulk/", BulkSendMessageView.as_view(), name="send_message_bulk"),
+    path("rooms/", ChatRoomListView.as_view(), name="room-list"),
+    path("rooms/<int:room_id>/messages/", RoomMessageView.as_view(), name="room-messages"),
+    path("rooms/<int:room_id>/read/", RoomReadView.as_view(), name="room-read"),
 ]
@@ -1,12 +1,24 @@
+import asyncio
+
+from asgiref.sync import async_to_sync, sync_to_async
+from channels.layers import get_channel_layer
 from rest_framework.views import APIView
 from rest_framework import generics, status
 from django.contrib.auth.models import User
+from django.db.models import Count
+from django.shortcuts import get_object_or_404
+from django.utils.cache import get_conditional_response
 from rest_framework.response import Response
 from rest_framework_simplejwt.tokens import RefreshToken
 from rest_framework.permissions import IsAuthenticated, AllowAny
 
-from .models import UserMessage
+from .history_cache import HISTORY_MAX_PAGE_SIZE, history_cache
+from .models import ChatRoom, RoomMembership, RoomMessage, UserMessage
+from .revocation import RevocableRefreshToken
 from .serializers import (
+    BulkSendMessageSerializer,
+    ChatRoomSerializer,
+    RoomMessageSerializer,
     UserLoginSerializer,
     UserMessageSerializer,
     UserRegisterSerializers,
@@ -57,7 +69,7 @@ class UserLogoutView(APIView):
                     status=status.HTTP_400_BAD_REQUEST,
                 )
 
-            token = RefreshToken(refresh_token)
+            token = RevocableRefreshToken(refresh_token)
             token.blacklist()
             return Response(
                 {"message": "User Logged Out."}, status=status.HTTP_205_RESET_CONTENT
@@ -83,22 +95,125 @@ class UserMessageView(APIView):
     def get(self, request, user_id):
         try:
             receiver = User.objects.get(id=user_id)
-            messages = (
-                UserMessage.objects.filter(sender=request.user, receiver=receiver) |
-                UserMessage.objects.filter(sender=receiver, receiver=request.user)
-            ).order_by("timestamp")
-            serializer = UserMessageSerializer(messages, many=True)
-            return Response(serializer.data, status=status.HTTP_200_OK)
+            before = request.query_params.get("before")
+            limit = request.query_params.get("limit")
+            try:
+                # int() rather than str.isdigit(), which also accepts digits like "²".
+                before = int(before) if before is not None else None
+                limit = int(limit) if limit is not None else None
+            except ValueError:
+                before = limit = -1
+            if (before is not None and before < 0) or (limit is not None and limit < 0):
+                return Response({"error": "before and limit must be non-negative integers."}, status=status.HTTP_400_BAD_REQUEST)
+
+            # Answer from the conversation version alone when the client
+            # already has this page, and from the page cache when another
+            # request has serialized it; only then read the messages table.
+            version = history_cache.get_version(request.user.id, receiver.id)
+            etag = f'"{version}"'
+            # No Last-Modified: at one-second resolution, a message saved in
+            # the same second as the client's copy would still get a 304.
+            response = get_conditional_response(request, etag=etag)
+            if response is None:
+                page = f"{before}_{limit}"
+                data = history_cache.get_page(request.user.id, receiver.id, version, page)
+                if data is None:
+                    data = self.get_history(request.user, receiver, before, limit)
+                    history_cache.set_page(request.user.id, receiver.id, version, page, data)
+                response = Response(data, status=status.HTTP_200_OK)
+            response["ETag"] = etag
+            response["Cache-Control"] = "private, no-cache"
+            return response
         except User.DoesNotExist:
             return Response({"error": "User not found."}, status=status.HTTP_404_NOT_FOUND)
         except Exception as e:
             return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
+    def get_history(self, user, other, before=None, limit=None):
+        """Messages of the conversation in timestamp order; with ``limit``, the last ones before ``before``."""
+        messages = (
+            UserMessage.objects.filter(sender=user, receiver=other) |
+            UserMessage.objects.filter(sender=other, receiver=user)
+        )
+        if before is not None:
+            messages = messages.filter(id__lt=before)
+        if limit is not None:
+            limit = min(limit, HISTORY_MAX_PAGE_SIZE)
+            messages = reversed(messages.order_by("-timestamp", "-id")[:limit])
+        else:
+            messages = messages.order_by("timestamp")
+        return list(UserMessageSerializer(messages, many=True).data)
+
+
+class AsyncAPIView(APIView):
+    """
+    APIView whose handlers are coroutines. Authentication, permission and
+    throttle checks still run through DRF, in a worker thread since they may
+    hit the database; the handler itself runs on the event loop.
+    """
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+            response = handler(request, *args, **kwargs)
+            if asyncio.iscoroutine(response):
+                response = await response
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+
+def chat_message_event(message):
+    return {
+        "type": "chat_message",
+        "message": message.message,
+        "sender_id": message.sender_id,
+        "receiver_id": message.receiver_id,
+        "timestamp": message.timestamp.isoformat(),
+        "message_id": message.id,
+    }
+
+
+async def publish_messages(messages):
+    """Push saved messages to the sender and receiver chat groups, the same way ChatConsumer does."""
+    channel_layer = get_channel_layer()
+    try:
+        for message in messages:
+            event = chat_message_event(message)
+            for user_id in {message.sender_id, message.receiver_id}:
+                await channel_layer.group_send(f"chat_{user_id}", event)
+    except Exception as e:
+        # The messages are saved; receivers will get them from history.
+        print(f"Failed to publish messages: {str(e)}")
 
-class SendMessageView(APIView):
+
+def announce_room_joined(room_id, user_ids):
+    """Tell the members' open sockets to join a room they were added to after connecting."""
+    channel_layer = get_channel_layer()
+    try:
+        for user_id in user_ids:
+            async_to_sync(channel_layer.group_send)(f"chat_{user_id}", {"type": "room_joined", "room_id": room_id})
+    except Exception as e:
+        # Their sockets join the room on the next connect or message instead.
+        print(f"Failed to announce room {room_id}: {str(e)}")
+
+
+class SendMessageView(AsyncAPIView):
     permission_classes = [IsAuthenticated]
 
-    def post(self, request):
+    async def post(self, request):
         if not request.data.get("message") or not request.data.get("message").strip():
             return Response({"error": "Message cannot be empty."}, status=status.HTTP_400_BAD_REQUEST)
         data = {
@@ -107,7 +222,112 @@ class SendMessageView(APIView):
             "sender": request.user,
         }
         serializer = UserMessageSerializer(data=data, context={'request': request})
-        if serializer.is_valid():
+
+        @sync_to_async
+        def save():
+            if not serializer.is_valid():
+                return None
             serializer.save(sender=request.user)
-            return Response(serializer.data, status=status.HTTP_201_CREATED)
-        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
\ No newline at end of file
+            return serializer.data
+
+        response_data = await save()
+        if response_data is None:
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        await publish_messages([serializer.instance])
+        return Response(response_data, status=status.HTTP_201_CREATED)
+
+
+class BulkSendMessageView(AsyncAPIView):
+    """Send many messages, to any number of receivers, in one request and one INSERT."""
+
+    permission_classes = [IsAuthenticated]
+
+    async def post(self, request):
+        serializer = BulkSendMessageSerializer(data=request.data)
+
+        @sync_to_async
+        def save():
+            if not serializer.is_valid():
+                return None
+            return serializer.save(sender=request.user)
+
+        messages = await save()
+        if messages is None:
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        await publish_messages(messages)
+        return Response(
+            {
+                "messages": [
+                    {
+                        "id": message.id,
+                        "receiver_id": message.receiver_id,
+                        "message": message.message,
+                        "timestamp": message.timestamp,
+                    }
+                    for message in messages
+                ]
+            },
+            status=status.HTTP_201_CREATED,
+        )
+
+
+# --------------------------------------------
+
+
+class ChatRoomListView(generics.ListCreateAPIView):
+    permission_classes = [IsAuthenticated]
+    serializer_class = ChatRoomSerializer
+
+    def get_queryset(self):
+        # Filtering through memberships would also narrow the join that
+        # Count runs over, so every room would have one member.
+        room_ids = RoomMembership.objects.filter(user=self.request.user).values("room_id")
+        return (
+            ChatRoom.objects.filter(id__in=room_ids)
+            .annotate(member_count=Count("memberships"))
+            .order_by("-created_at")
+        )
+
+    def perform_create(self, serializer):
+        room = serializer.save(created_by=self.request.user)
+        announce_room_joined(room.id, room.member_ids)
+
+
+class RoomMessageView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, room_id):
+        membership = get_object_or_404(RoomMembership, room_id=room_id, user=request.user)
+        messages = (
+            RoomMessage.objects.filter(room_id=room_id)
+            .select_related("sender")
+            .order_by("id")
+        )
+        serializer = RoomMessageSerializer(messages, many=True)
+        unread_count = messages.filter(id__gt=membership.last_read_message_id).count()
+        return Response(
+            {
+                "messages": serializer.data,
+                "last_read_message_id": membership.last_read_message_id,
+                "unread_count": unread_count,
+            },
+            status=status.HTTP_200_OK,
+        )
+
+
+class RoomReadView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, room_id):
+        membership = get_object_or_404(RoomMembership, room_id=room_id, user=request.user)
+        try:
+            message_id = int(request.data.get("message_id"))
+        except (TypeError, ValueError):
+            return Response({"error": "message_id is required."}, status=status.HTTP_400_BAD_REQUEST)
+
+        RoomMembership.mark_read(room_id, request.user.id, message_id)
+        membership.refresh_from_db(fields=["last_read_message_id"])
+        return Response(
+            {"last_read_message_id": membership.last_read_message_id},
+            status=status.HTTP_200_OK,
+        )
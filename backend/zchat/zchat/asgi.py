@@ -11,12 +11,16 @@ import os
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
 from django.core.asgi import get_asgi_application
-from users import routing
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "zchat.settings")
 
+# Set up Django before the consumers import any models.
+django_asgi_app = get_asgi_application()
+
+from users import routing  # noqa: E402
+
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+    "http": django_asgi_app,
     "websocket": AuthMiddlewareStack(
         URLRouter(routing.websocket_urlpatterns)
     )
@@ -0,0 +1,26 @@
+"""
+ASGI entry point for WebSocket-only workers.
+
+Loads the slim ``zchat.settings_realtime`` profile and only the WebSocket
+routes, without Django's HTTP handler. Run it behind a router that sends
+``/ws/`` traffic here and everything else to ``zchat.asgi``::
+
+    python -m zchat.server zchat.asgi_realtime:application
+"""
+
+import os
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "zchat.settings_realtime")
+django.setup()
+
+from channels.auth import AuthMiddlewareStack  # noqa: E402
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from users import routing  # noqa: E402
+
+application = ProtocolTypeRouter({
+    "websocket": AuthMiddlewareStack(
+        URLRouter(routing.websocket_urlpatterns)
+    )
+})
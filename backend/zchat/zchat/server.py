@@ -0,0 +1,79 @@
+"""
+Daphne with permessage-deflate negotiated on WebSocket connections.
+
+Daphne does not enable WebSocket compression on its own. Start the project
+with this module instead of the ``daphne`` command; it accepts the same
+options::
+
+    python -m zchat.server -b 0.0.0.0 -p 8000 zchat.asgi:application
+
+Set ``WEBSOCKET_PERMESSAGE_DEFLATE=false`` to turn compression off, and
+``WEBSOCKET_DEFLATE_MEM_LEVEL`` (1-9) to trade ratio for per-socket memory.
+
+On SIGTERM the server drains instead of stopping at once: it stops
+listening, tells connected clients to reconnect after a random delay of up
+to ``WEBSOCKET_RECONNECT_JITTER`` seconds, and waits up to
+``WEBSOCKET_DRAIN_TIMEOUT`` seconds for in-flight message saves.
+"""
+
+import asyncio
+import logging
+import os
+import signal
+
+from autobahn.websocket.compress import PerMessageDeflateOffer, PerMessageDeflateOfferAccept
+from daphne.cli import CommandLineInterface as DaphneCommandLineInterface
+from daphne.server import Server as DaphneServer, reactor
+
+from users.drain import drain
+
+logger = logging.getLogger(__name__)
+
+
+def accept_permessage_deflate(offers):
+    mem_level = os.getenv("WEBSOCKET_DEFLATE_MEM_LEVEL")
+    for offer in offers:
+        if isinstance(offer, PerMessageDeflateOffer):
+            return PerMessageDeflateOfferAccept(offer, mem_level=int(mem_level) if mem_level else None)
+    return None
+
+
+class Server(DaphneServer):
+    def run(self):
+        self.ports = []
+        if os.getenv("WEBSOCKET_PERMESSAGE_DEFLATE", "true").lower() in ("1", "true", "yes"):
+            # The WebSocket factory is built inside run(); this fires once the
+            # reactor starts and before any connection is accepted.
+            reactor.callWhenRunning(self.enable_permessage_deflate)
+        if self.signal_handlers:
+            # Runs after Twisted installed its own handlers, replacing the SIGTERM one.
+            reactor.callWhenRunning(signal.signal, signal.SIGTERM, self.handle_sigterm)
+        super().run()
+
+    def enable_permessage_deflate(self):
+        self.ws_factory.setProtocolOptions(perMessageCompressionAccept=accept_permessage_deflate)
+
+    def listen_success(self, port):
+        self.ports.append(port)
+        super().listen_success(port)
+
+    def handle_sigterm(self, signum, frame):
+        reactor.callFromThread(self.drain)
+
+    def drain(self):
+        logger.info("Draining: no longer accepting connections")
+        for port in self.ports:
+            port.stopListening()
+        future = asyncio.ensure_future(drain.drain(
+            timeout=float(os.getenv("WEBSOCKET_DRAIN_TIMEOUT", 30)),
+            reconnect_jitter=float(os.getenv("WEBSOCKET_RECONNECT_JITTER", 10)),
+        ))
+        future.add_done_callback(lambda _: self.stop())
+
+
+class CommandLineInterface(DaphneCommandLineInterface):
+    server_class = Server
+
+
+if __name__ == "__main__":
+    CommandLineInterface.entrypoint()
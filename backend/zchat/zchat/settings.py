@@ -12,10 +12,14 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 
 from pathlib import Path
 from datetime import timedelta
-from dotenv import load_dotenv
 import os
 
-load_dotenv()
+# Containers get their environment injected; set DJANGO_LOAD_DOTENV=false
+# there to skip searching for and parsing a .env file on every start.
+if os.getenv("DJANGO_LOAD_DOTENV", "true").lower() in ("1", "true", "yes"):
+    from dotenv import load_dotenv
+
+    load_dotenv()
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -41,8 +45,17 @@ REST_FRAMEWORK = {
 SIMPLE_JWT = {
     "ACCESS_TOKEN_LIFETIME": timedelta(hours=12),
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
+    "TOKEN_REFRESH_SERIALIZER": "users.serializers.RevocableTokenRefreshSerializer",
 }
 
+# Blacklisted refresh tokens are checked against a bloom filter first, see
+# users.revocation. Workers pick up revocations through the shared cache, and
+# the filter is rebuilt in the background every REVOCATION_REBUILD_INTERVAL
+# seconds. With a per-process cache every token is checked in the database.
+REVOCATION_BLOOM_CAPACITY = int(os.getenv("REVOCATION_BLOOM_CAPACITY", 100000))
+REVOCATION_BLOOM_ERROR_RATE = float(os.getenv("REVOCATION_BLOOM_ERROR_RATE", 0.01))
+REVOCATION_REBUILD_INTERVAL = int(os.getenv("REVOCATION_REBUILD_INTERVAL", 60))
+
 
 # Application definition
 
@@ -93,15 +106,83 @@ TEMPLATES = [
 WSGI_APPLICATION = "zchat.wsgi.application"
 ASGI_APPLICATION = "zchat.asgi.application"
 
+# Comma separated Redis URLs; groups and channels are spread over them with
+# consistent hashing. Append new hosts at the end to keep existing routing.
+CHANNEL_REDIS_HOSTS = os.getenv("CHANNEL_REDIS_HOSTS", "redis://127.0.0.1:6379").split(",")
+
 CHANNEL_LAYERS = {
     "default": {
-        "BACKEND": "channels_redis.core.RedisChannelLayer",
+        "BACKEND": "users.channel_layers.ShardedRedisChannelLayer",
         "CONFIG": {
-            "hosts": [("127.0.0.1", 6379)],
+            "hosts": CHANNEL_REDIS_HOSTS,
+            # Checked in order, first matching pattern wins. Anything else
+            # (call signaling groups) falls back to the short-lived default.
+            "group_policies": {
+                "chat_*": {"expiry": 86400, "capacity": 100},
+                "room_*": {"expiry": 86400, "capacity": 200},
+                "*": {"expiry": 3600, "capacity": 50},
+            },
         },
     },
 }
 
+# Presence, rate limits, token revocation and history versions are shared
+# by all workers through this cache, so it has to be one every worker
+# process reaches. Defaults to the first channel layer Redis host.
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", CHANNEL_REDIS_HOSTS[0])
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": CACHE_REDIS_URL,
+    }
+}
+
+# Presence: a connection is considered gone if no heartbeat arrives within
+# PRESENCE_TTL seconds; status changes are broadcast in batches. Each user
+# can have up to PRESENCE_MAX_CONNECTIONS tracked sockets.
+PRESENCE_TTL = int(os.getenv("PRESENCE_TTL", 60))
+PRESENCE_FLUSH_INTERVAL = float(os.getenv("PRESENCE_FLUSH_INTERVAL", 2.0))
+PRESENCE_MAX_CONNECTIONS = int(os.getenv("PRESENCE_MAX_CONNECTIONS", 16))
+
+# Typing indicators are relayed at most once per interval for each sender/receiver pair.
+TYPING_THROTTLE_INTERVAL = float(os.getenv("TYPING_THROTTLE_INTERVAL", 2.0))
+
+# Token bucket limits for incoming WebSocket frames, per connection and per
+# event type: "rate" tokens per second up to "burst". Each user gets
+# WEBSOCKET_USER_RATE_FACTOR times that budget across all of their sockets.
+# Set WEBSOCKET_RATE_LIMIT_BACKEND=cache to share user budgets across workers.
+WEBSOCKET_RATE_LIMITS = {
+    "message": {"rate": 5, "burst": 20},
+    "room_message": {"rate": 5, "burst": 20},
+    "typing": {"rate": 2, "burst": 5},
+    "heartbeat": {"rate": 1, "burst": 3},
+    "call": {"rate": 0.5, "burst": 3},
+    "answer_call": {"rate": 0.5, "burst": 3},
+    "ICEcandidate": {"rate": 50, "burst": 100},
+    "default": {"rate": 10, "burst": 30},
+}
+WEBSOCKET_USER_RATE_FACTOR = int(os.getenv("WEBSOCKET_USER_RATE_FACTOR", 3))
+WEBSOCKET_RATE_LIMIT_BACKEND = os.getenv("WEBSOCKET_RATE_LIMIT_BACKEND", "memory")
+
+# ICE candidates sent to the same peer within this many seconds are batched
+# into one channel-layer message. Set to 0 to forward them one by one.
+CALL_ICE_BATCH_WINDOW = float(os.getenv("CALL_ICE_BATCH_WINDOW", 0.03))
+
+# Largest number of messages accepted by one request to the bulk send endpoint.
+BULK_SEND_MAX_MESSAGES = int(os.getenv("BULK_SEND_MAX_MESSAGES", 100))
+
+# Largest number of message ids accepted in one frame on the receipts stream.
+RECEIPT_MAX_MESSAGES = int(os.getenv("RECEIPT_MAX_MESSAGES", 500))
+
+# Conversation history pages are cached per conversation version in the
+# HISTORY_CACHE_ALIAS cache; the version is also the ETag of the history.
+# It must be shared by all workers, or a worker may serve an old page, so
+# the system checks (run by migrate and check) reject a per-process cache.
+HISTORY_CACHE_ALIAS = os.getenv("HISTORY_CACHE_ALIAS", "default")
+HISTORY_CACHE_TIMEOUT = int(os.getenv("HISTORY_CACHE_TIMEOUT", 300))
+HISTORY_MAX_PAGE_SIZE = int(os.getenv("HISTORY_MAX_PAGE_SIZE", 200))
+
 # Database
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
@@ -113,9 +194,48 @@ DATABASES = {
         "PASSWORD": os.getenv("DATABASE_PASSWORD"),
         "HOST": os.getenv("DATABASE_HOST"),
         "PORT": os.getenv("DATABASE_PORT"),
+        # Under Daphne, sync code runs in executor threads that outlive the
+        # request, so persistent connections pile up instead of being reused.
+        # Keep the Django default of closing them and use DATABASE_POOL to
+        # avoid reconnecting for every request and every database call.
+        "CONN_MAX_AGE": int(os.getenv("DATABASE_CONN_MAX_AGE", 0)),
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {},
     }
 }
 
+# With DATABASE_POOL enabled, each worker shares a bounded psycopg 3 pool so a
+# reconnect storm after a deploy cannot use up the server's connection slots.
+if os.getenv("DATABASE_POOL", "false").lower() in ("1", "true", "yes"):
+    from psycopg_pool import ConnectionPool
+
+    DATABASES["default"]["CONN_MAX_AGE"] = 0
+    DATABASES["default"]["OPTIONS"]["pool"] = {
+        "min_size": int(os.getenv("DATABASE_POOL_MIN_SIZE", 2)),
+        "max_size": int(os.getenv("DATABASE_POOL_MAX_SIZE", 10)),
+        "timeout": float(os.getenv("DATABASE_POOL_TIMEOUT", 10)),
+        "max_idle": float(os.getenv("DATABASE_POOL_MAX_IDLE", 300)),
+        "check": ConnectionPool.check_connection,
+    }
+
+
+# Password hashing
+# PASSWORD_HASH_ITERATIONS of 0 keeps Django's PBKDF2 default. Passwords
+# stored with a different count are rehashed on their next login.
+# PASSWORD_HASH_WORKERS of 0 gives one hashing thread per CPU.
+
+PASSWORD_HASHERS = [
+    "users.hashers.ConfigurablePBKDF2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2PasswordHasher",
+    "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
+    "django.contrib.auth.hashers.Argon2PasswordHasher",
+    "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
+    "django.contrib.auth.hashers.ScryptPasswordHasher",
+]
+
+PASSWORD_HASH_ITERATIONS = int(os.getenv("PASSWORD_HASH_ITERATIONS", 0))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 0))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -0,0 +1,21 @@
+"""
+Settings for WebSocket-only workers (zchat.asgi_realtime).
+
+They serve ChatConsumer and CallConsumer and nothing else, so the admin,
+messages, static files, DRF, CORS and the HTTP middleware stack are left
+out to keep worker start-up short. Sessions stay because
+AuthMiddlewareStack reads the session cookie.
+"""
+
+from .settings import *  # noqa: F401,F403
+
+INSTALLED_APPS = [
+    "django.contrib.auth",
+    "django.contrib.contenttypes",
+    "django.contrib.sessions",
+    "users",
+]
+
+MIDDLEWARE = []
+
+TEMPLATES = []